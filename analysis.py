@@ -0,0 +1,258 @@
+from itertools import combinations
+from typing import Callable
+
+import numpy as np
+
+import mat
+from profiling import profiler
+
+
+class Analyzer:
+    max_markers = 500
+    max_grid_points = 10_000
+
+    def __init__(self):
+        self.__curves: dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+        self.__pairs: dict[tuple, np.ndarray] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def analyze(self, graphs: list[mat.AbstractGraph]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # returns the roots, extrema and intersections as (n, 2) arrays of plot coordinates
+        # an integral has no closed form to refine on, derivatives are curves of their own
+        graphs = [graph for graph in graphs if isinstance(graph, (mat.GraphY, mat.GraphX, mat.GraphDerivative))
+                  and graph.func is not None and graph.family is None and graph.arg_axis is not None]
+        # results stay valid while the function, its parameters and the viewport are the same
+        keys = {graph: (graph, graph.state()) for graph in graphs}
+
+        curves = {keys[graph]: self.__curves[keys[graph]] for graph in graphs if keys[graph] in self.__curves}
+        self.hits += len(curves)
+        missing = [graph for graph in graphs if keys[graph] not in curves]
+        if missing:
+            self.misses += len(missing)
+            with profiler.stage("analysis"):
+                for graph, found in zip(missing, analyze_curves(missing, self.max_markers)):
+                    curves[keys[graph]] = found
+        self.__curves = curves
+
+        pairs = {}
+        for arg_axis in (0, 1):
+            # graphs of y and of x have different arguments, they are only compared among themselves
+            group = [graph for graph in graphs if graph.arg_axis == arg_axis]
+            missing = []
+            for first, second in combinations(group, 2):
+                key = (keys[first], keys[second])
+                if key in self.__pairs:
+                    self.hits += 1
+                    pairs[key] = self.__pairs[key]
+                else:
+                    self.misses += 1
+                    missing.append((first, second))
+            if missing:
+                with profiler.stage("analysis intersections"):
+                    found = intersect(missing, self.max_markers, self.max_grid_points)
+                for (first, second), points in zip(missing, found):
+                    pairs[(keys[first], keys[second])] = points
+        self.__pairs = pairs
+
+        empty = np.empty((0, 2))
+        return (np.concatenate([empty, *(roots for roots, _ in curves.values())]),
+                np.concatenate([empty, *(extrema for _, extrema in curves.values())]),
+                np.concatenate([empty, *pairs.values()]))
+
+
+def curve(graph: mat.FuncGraph) -> tuple[np.ndarray, np.ndarray]:
+    # the drawn samples with the argument of the graph first, breaks are nan in both arrays
+    x = np.asarray(graph.line.get_xdata(), dtype=float)
+    y = np.asarray(graph.line.get_ydata(), dtype=float)
+    return (y, x) if graph.arg_axis == 1 else (x, y)
+
+
+def to_points(graph: mat.FuncGraph, args: np.ndarray, vals: np.ndarray) -> np.ndarray:
+    points = np.empty((len(args), 2))
+    points[:, graph.arg_axis] = args
+    points[:, 1 - graph.arg_axis] = vals
+    return points
+
+
+def by_graph(funcs: list[Callable], owner: np.ndarray, args: np.ndarray) -> np.ndarray:
+    # one call per function for all points that belong to it
+    order = np.argsort(owner, kind="stable")
+    graphs, starts = np.unique(owner[order], return_index=True)
+    out = np.empty(len(args))
+    for g, part in zip(graphs, np.split(order, starts[1:])):
+        out[part] = funcs[g](args[part])
+    return out
+
+
+def analyze_curves(graphs: list[mat.FuncGraph], max_markers: int) -> list[tuple[np.ndarray, np.ndarray]]:
+    # roots and extrema of all graphs are refined together, so the number of steps does not grow with them
+    funcs = [graph.values for graph in graphs]
+    curves = [curve(graph) for graph in graphs]
+    zeros, brackets, turns = [], [], []
+    for g, (args, vals) in enumerate(curves):
+        with np.errstate(invalid="ignore"):
+            idx = np.flatnonzero(vals[:-1] * vals[1:] < 0)
+            # a sample exactly at zero is a root unless the curve stays at zero next to it
+            zero = vals == 0
+            zero[1:] &= vals[:-1] != 0
+            zero[:-1] &= vals[1:] != 0
+            # the slope changes sign around a sample, next to a break it is nan and never does
+            slope = np.sign(np.diff(vals))
+            turn = np.flatnonzero(slope[:-1] * slope[1:] < 0) + 1
+        if len(idx) + np.count_nonzero(zero) > max_markers:
+            idx, zero = idx[:0], zero & False
+        if len(turn) > max_markers:
+            turn = turn[:0]
+        zeros.append(np.flatnonzero(zero))
+        brackets.append(idx)
+        turns.append(turn)
+
+    owner = np.repeat(np.arange(len(graphs)), [len(idx) for idx in brackets])
+    lo = np.concatenate([np.empty(0), *(curves[g][0][i] for g, i in enumerate(brackets))])
+    hi = np.concatenate([np.empty(0), *(curves[g][0][i + 1] for g, i in enumerate(brackets))])
+    f_lo = np.concatenate([np.empty(0), *(curves[g][1][i] for g, i in enumerate(brackets))])
+    f_hi = np.concatenate([np.empty(0), *(curves[g][1][i + 1] for g, i in enumerate(brackets))])
+    roots = refine_roots(lambda items, t: by_graph(funcs, owner[items], t), lo, hi, f_lo, f_hi)
+
+    turn_owner = np.repeat(np.arange(len(graphs)), [len(turn) for turn in turns])
+    turn_args = np.concatenate([np.empty(0), *(curves[g][0][i] for g, i in enumerate(turns))])
+    turn_vals = np.concatenate([np.empty(0), *(curves[g][1][i] for g, i in enumerate(turns))])
+    lo = np.concatenate([np.empty(0), *(curves[g][0][i - 1] for g, i in enumerate(turns))])
+    hi = np.concatenate([np.empty(0), *(curves[g][0][i + 1] for g, i in enumerate(turns))])
+    direction = np.concatenate([np.empty(0), *(np.sign(curves[g][1][i] - curves[g][1][i - 1])
+                                               for g, i in enumerate(turns))])
+    found = refine_extrema(funcs, turn_owner, lo, hi)
+    with np.errstate(invalid="ignore"):
+        found_vals = by_graph(funcs, turn_owner, found)
+        # the refined point has to be at least as extreme as the sample it started from
+        better = direction * found_vals >= direction * turn_vals
+    extrema_args = np.where(better, found, turn_args)
+    extrema_vals = np.where(better, found_vals, turn_vals)
+
+    results = []
+    for g, graph in enumerate(graphs):
+        args = curves[g][0]
+        refined = roots[owner == g]
+        graph_roots = np.sort(np.concatenate((args[zeros[g]], refined[np.isfinite(refined)])))
+        mine = turn_owner == g
+        results.append((to_points(graph, graph_roots, np.zeros(len(graph_roots))),
+                        to_points(graph, extrema_args[mine], extrema_vals[mine])))
+    return results
+
+
+def intersect(pairs: list[tuple[mat.FuncGraph, mat.FuncGraph]], max_markers: int,
+              max_grid_points: int) -> list[np.ndarray]:
+    graphs = list(dict.fromkeys(graph for pair in pairs for graph in pair))
+    index = {graph: i for i, graph in enumerate(graphs)}
+    funcs = [graph.values for graph in graphs]
+    curves = [curve(graph) for graph in graphs]
+    first = np.array([index[a] for a, _ in pairs])
+    second = np.array([index[b] for _, b in pairs])
+
+    # every curve is resampled on one grid of two points per pixel, the differences of all pairs at once
+    # give the brackets, which are then checked and refined on the functions themselves
+    finite = [args[np.isfinite(args)] for args, _ in curves]
+    finite = [args for args in finite if len(args)]
+    if not finite:
+        return [np.empty((0, 2)) for _ in pairs]
+    arg_min = min(args[0] for args in finite)
+    arg_max = max(args[-1] for args in finite)
+    scale = graphs[0].scale_y if graphs[0].arg_axis == 1 else graphs[0].scale_x
+    grid = np.linspace(arg_min, arg_max, int(np.clip(2 * (arg_max - arg_min) * scale, 2, max_grid_points)))
+    resampled = np.stack([resample(args, vals, grid) for args, vals in curves])
+    with np.errstate(invalid="ignore"):
+        diff = resampled[first] - resampled[second]
+        pair, i = np.nonzero(diff[:, :-1] * diff[:, 1:] < 0)
+
+    def difference(pair: np.ndarray, t: np.ndarray) -> np.ndarray:
+        n = len(t)
+        vals = by_graph(funcs, np.concatenate((first[pair], second[pair])), np.concatenate((t, t)))
+        return vals[:n] - vals[n:]
+
+    lo, hi = grid[i], grid[i + 1]
+    with np.errstate(invalid="ignore"):
+        f_lo, f_hi = difference(pair, lo), difference(pair, hi)
+        # the drawn curves are only an approximation, a bracket counts if the functions agree with it
+        bracket = f_lo * f_hi < 0
+    pair, lo, hi, f_lo, f_hi = pair[bracket], lo[bracket], hi[bracket], f_lo[bracket], f_hi[bracket]
+    roots = refine_roots(lambda items, t: difference(pair[items], t), lo, hi, f_lo, f_hi)
+
+    refined = np.isfinite(roots)
+    pair, roots = pair[refined], roots[refined]
+    points = to_points(graphs[0], roots, by_graph(funcs, first[pair], roots))
+    counts = np.bincount(pair, minlength=len(pairs))
+    return [found if len(found) <= max_markers else np.empty((0, 2))
+            for found in np.split(points[np.argsort(pair, kind="stable")], np.cumsum(counts)[:-1])]
+
+
+def resample(args: np.ndarray, vals: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    if len(args) < 2 or np.isnan(args[0]):
+        return np.full(len(grid), np.nan)
+    # the argument of a break is replaced by the one before it, so the arguments stay sorted
+    # and the nan value covers only the gap
+    return np.interp(grid, np.fmax.accumulate(args), vals, left=np.nan, right=np.nan)
+
+
+def refine_roots(evaluate: Callable[[np.ndarray, np.ndarray], np.ndarray], lo: np.ndarray, hi: np.ndarray,
+                 f_lo: np.ndarray, f_hi: np.ndarray, max_iter=60) -> np.ndarray:
+    # Illinois steps on all brackets at once: a secant step inside the bracket, where the value at an end
+    # that is kept twice in a row is halved, and bisection where the secant step is not usable.
+    # evaluate gets the indices of the brackets and their new points. Rejected brackets give nan
+    lo, hi = np.array(lo, dtype=float), np.array(hi, dtype=float)
+    f_lo, f_hi = np.array(f_lo, dtype=float), np.array(f_hi, dtype=float)
+    start = np.fmin(np.abs(f_lo), np.abs(f_hi))
+    tolerance = (hi - lo) * 1e-12
+    roots = (lo + hi) / 2
+    f_roots = np.full(len(lo), np.nan)
+    kept = np.zeros(len(lo), dtype=np.int8)
+
+    active = np.arange(len(lo))
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        a, b, fa, fb = lo[active], hi[active], f_lo[active], f_hi[active]
+        with np.errstate(all="ignore"):
+            t = (a * fb - b * fa) / (fb - fa)
+            bisect = ~((t > a) & (t < b))
+            t[bisect] = (a[bisect] + b[bisect]) / 2
+            ft = evaluate(active, t)
+            right = np.sign(ft) == np.sign(fa)
+
+        roots[active] = t
+        f_roots[active] = ft
+        last = kept[active]
+        kept[active] = np.where(right, 1, -1)
+        lo[active] = np.where(right, t, a)
+        hi[active] = np.where(right, b, t)
+        f_lo[active] = np.where(right, ft, np.where(last == -1, fa / 2, fa))
+        f_hi[active] = np.where(right, np.where(last == 1, fb / 2, fb), ft)
+
+        done = ((ft == 0) | ~np.isfinite(ft)
+                | (hi[active] - lo[active] <= tolerance[active] + 4 * np.spacing(np.abs(t))))
+        active = active[~done]
+
+    # a pole changes the sign as well, but there the value grows while the bracket shrinks
+    with np.errstate(invalid="ignore"):
+        return np.where(np.abs(f_roots) <= start, roots, np.nan)
+
+
+def refine_extrema(funcs: list[Callable], owner: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    # an extremum is a root of the slope, taken as a symmetric difference much narrower than the bracket;
+    # where the slope does not change sign between the ends the middle of the bracket is returned
+    step = (hi - lo) * 1e-4
+
+    def slope(items: np.ndarray, t: np.ndarray) -> np.ndarray:
+        n = len(t)
+        vals = by_graph(funcs, np.concatenate((owner[items], owner[items])),
+                        np.concatenate((t + step[items], t - step[items])))
+        return vals[:n] - vals[n:]
+
+    items = np.arange(len(lo))
+    with np.errstate(invalid="ignore"):
+        s_lo, s_hi = slope(items, lo), slope(items, hi)
+        bracket = s_lo * s_hi < 0
+    found = (lo + hi) / 2
+    found[bracket] = refine_roots(lambda items, t: slope(np.flatnonzero(bracket)[items], t),
+                                  lo[bracket], hi[bracket], s_lo[bracket], s_hi[bracket])
+    return found
@@ -0,0 +1,206 @@
+from functools import wraps
+from typing import Callable
+
+import numpy as np
+import sympy as sm
+
+BACKENDS = ("numpy", "cse", "numexpr", "auto")
+
+_UFUNCS = {
+    sm.sin: "sin", sm.cos: "cos", sm.tan: "tan", sm.asin: "arcsin", sm.acos: "arccos", sm.atan: "arctan",
+    sm.sinh: "sinh", sm.cosh: "cosh", sm.tanh: "tanh", sm.asinh: "arcsinh", sm.acosh: "arccosh",
+    sm.atanh: "arctanh", sm.exp: "exp", sm.log: "log", sm.Abs: "absolute", sm.floor: "floor",
+    sm.ceiling: "ceil", sm.sign: "sign",
+}
+_NAMESPACE = {name: getattr(np, name) for name in (
+    *_UFUNCS.values(), "add", "multiply", "divide", "power", "square", "sqrt", "arctan2", "empty", "asarray",
+    "array", "broadcast_to", "broadcast_shapes", "float64",
+)}
+
+
+def compile_expression(expr: sm.Expr, symbols: tuple[sm.Symbol, ...], mods: list,
+                       backend="numpy") -> tuple[Callable, str]:
+    if not any(symbol in expr.free_symbols for symbol in symbols):
+        return sm.lambdify([], expr, mods), "numpy"
+
+    func = sm.lambdify(symbols if len(symbols) > 1 else symbols[0], expr, mods)
+    if backend == "auto":
+        backend = choose_backend(expr)
+    try:
+        match backend:
+            case "cse":
+                return _with_fallback(cse_function(expr, symbols), func), "cse"
+            case "numexpr":
+                return _with_fallback(numexpr_function(expr, symbols), func), "numexpr"
+    except (ImportError, NotImplementedError, TypeError, ValueError):
+        pass
+    return func, "numpy"
+
+
+def choose_backend(expr: sm.Expr) -> str:
+    # bench.py --backends: numexpr only wins on polynomials, cse on functions nested in arithmetic,
+    # a lone function call or root is fastest as numpy evaluates it
+    if sm.count_ops(expr) < 2:
+        return "numpy"
+    if expr.atoms(sm.Function):
+        return "cse"
+    if all(power.exp.is_Integer for power in expr.atoms(sm.Pow)) and _have_numexpr():
+        return "numexpr"
+    return "numpy"
+
+
+def _have_numexpr() -> bool:
+    try:
+        import numexpr
+    except ImportError:
+        return False
+    return True
+
+
+def _with_fallback(func: Callable, fallback: Callable) -> Callable:
+    @wraps(func)
+    def call(*args):
+        try:
+            return func(*args)
+        except Exception:
+            return fallback(*args)
+    return call
+
+
+def numexpr_function(expr: sm.Expr, symbols: tuple[sm.Symbol, ...]) -> Callable:
+    import numexpr
+    return sm.lambdify(symbols if len(symbols) > 1 else symbols[0], expr, "numexpr")
+
+
+def cse_function(expr: sm.Expr, symbols: tuple[sm.Symbol, ...]) -> Callable:
+    source = cse_source(expr, symbols)
+    namespace = dict(_NAMESPACE)
+    exec(source, namespace)
+    func = namespace["_cse_func"]
+    func.source = source
+    return func
+
+
+def cse_source(expr: sm.Expr, symbols: tuple[sm.Symbol, ...]) -> str:
+    replacements, (reduced,) = sm.cse(expr)
+    args = [str(symbol) for symbol in symbols]
+    lines = [f"{arg} = asarray({arg}, dtype=float64)" for arg in args]
+    lines.append(f"_shape = broadcast_shapes({', '.join(arg + '.shape' for arg in args)})")
+
+    generator = _Generator({symbol: str(symbol) for symbol in symbols}, lines)
+    exprs = [sub for _, sub in replacements] + [reduced]
+    last_use = {}
+    for i, sub in enumerate(exprs):
+        for symbol, _ in replacements:
+            if symbol in sub.free_symbols:
+                last_use[symbol] = i
+
+    for i, (symbol, sub) in enumerate(replacements):
+        generator.names[symbol], _ = generator.emit(sub)
+        # a common subexpression's buffer is reused once nothing below reads it
+        for done, _ in replacements[:i + 1]:
+            if last_use.get(done) == i:
+                generator.release(generator.names[done])
+
+    result, owned = generator.emit(reduced)
+    if owned:
+        lines.append(f"return {result}")
+    else:
+        lines.append(f"return array(broadcast_to({result}, _shape), dtype=float64)")
+    return f"def _cse_func({', '.join(args)}):\n" + "".join(f"    {line}\n" for line in lines)
+
+
+class _Generator:
+    def __init__(self, names: dict[sm.Symbol, str], lines: list[str]):
+        self.names = names
+        self.lines = lines
+        self.free: list[str] = []
+        self.count = 0
+
+    def buffer(self) -> str:
+        if self.free:
+            return self.free.pop()
+        name = f"_b{self.count}"
+        self.count += 1
+        self.lines.append(f"{name} = empty(_shape)")
+        return name
+
+    def release(self, name: str):
+        if name.startswith("_b") and name not in self.free:
+            self.free.append(name)
+
+    def emit(self, expr: sm.Expr) -> tuple[str, bool]:
+        # returns the operand and whether it is a scratch buffer the caller may overwrite
+        if expr in self.names:
+            return self.names[expr], False
+        if expr.is_number:
+            value = complex(expr)
+            if value.imag != 0:
+                raise NotImplementedError("complex constants")
+            return repr(value.real), False
+        if isinstance(expr, sm.Add):
+            return self.__chain("add", expr.args)
+        if isinstance(expr, sm.Mul):
+            return self.__chain("multiply", expr.args)
+        if isinstance(expr, sm.Pow):
+            return self.__power(*expr.args)
+        if isinstance(expr, sm.atan2):
+            return self.__call("arctan2", expr.args)
+        if type(expr) in _UFUNCS and len(expr.args) == 1:
+            return self.__call(_UFUNCS[type(expr)], expr.args)
+        raise NotImplementedError(type(expr).__name__)
+
+    def __chain(self, ufunc: str, args: tuple) -> tuple[str, bool]:
+        operands = [self.emit(arg) for arg in args]
+        # the output buffer has to be read first, before it gets overwritten
+        operands.sort(key=lambda operand: not operand[1])
+        out = operands[0][0] if operands[0][1] else self.buffer()
+        acc = operands[0][0]
+        for name, _ in operands[1:]:
+            self.lines.append(f"{ufunc}({acc}, {name}, out={out})")
+            acc = out
+        for name, owned in operands[1:]:
+            if owned:
+                self.release(name)
+        return out, True
+
+    def __power(self, base: sm.Expr, exp: sm.Expr) -> tuple[str, bool]:
+        name, owned = self.emit(base)
+        if exp.is_number and float(exp) == 3:
+            # small integer powers are much cheaper as products than through power()
+            out = self.buffer()
+            self.lines.append(f"square({name}, out={out})")
+            self.lines.append(f"multiply({out}, {name}, out={out})")
+            if owned:
+                self.release(name)
+            return out, True
+
+        out = name if owned else self.buffer()
+        if exp.is_number:
+            value = float(exp)
+            if value == 2:
+                self.lines.append(f"square({name}, out={out})")
+            elif value == 4:
+                self.lines.append(f"square({name}, out={out})")
+                self.lines.append(f"square({out}, out={out})")
+            elif value == 0.5:
+                self.lines.append(f"sqrt({name}, out={out})")
+            elif value == -1:
+                self.lines.append(f"divide(1.0, {name}, out={out})")
+            else:
+                self.lines.append(f"power({name}, {value!r}, out={out})")
+        else:
+            exp_name, exp_owned = self.emit(exp)
+            self.lines.append(f"power({name}, {exp_name}, out={out})")
+            if exp_owned:
+                self.release(exp_name)
+        return out, True
+
+    def __call(self, ufunc: str, args: tuple) -> tuple[str, bool]:
+        operands = [self.emit(arg) for arg in args]
+        out = next((name for name, owned in operands if owned), None) or self.buffer()
+        self.lines.append(f"{ufunc}({', '.join(name for name, _ in operands)}, out={out})")
+        for name, owned in operands:
+            if owned and name != out:
+                self.release(name)
+        return out, True
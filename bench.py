@@ -0,0 +1,364 @@
+import argparse
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from typing import Callable
+
+import numpy as np
+
+import analysis
+import backends
+import mat
+
+EXPRESSIONS = [
+    "x", "x**2 - 3*x + 2", "sin(x)", "cos(x)*exp(-x**2/10)", "tan(x)", "1/x", "sqrt(x)", "log(x)",
+    "logb(x, 2)", "Abs(sin(x))*x", "sin(1/x)", "x*sin(50*x)", "floor(x)", "exp(x)/(1 + exp(x))",
+    "sin(x)**2 + sin(x)*cos(x)", "atan(x)", "x^3 - x", "5",
+]
+ZOOM_SPANS = [0.01, 1, 20, 100, 1000]
+POINT_COUNTS = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+REDRAW_GRAPHS = [1, 10, 30]
+
+
+def make_process_text_bench(cache_dir: str | None) -> Callable[[], int]:
+    def bench() -> int:
+        mat.expression_cache.clear()
+        mat.expression_cache.cache_dir = cache_dir
+        graph = mat.GraphY()
+        for text in EXPRESSIONS:
+            graph.process_text(text)
+        return len(EXPRESSIONS)
+    return bench
+
+
+def bench_process_text_cached() -> int:
+    graph = mat.GraphY()
+    for text in EXPRESSIONS:
+        graph.process_text(text)
+    return len(EXPRESSIONS)
+
+
+def make_draw_bench(span: float) -> Callable[[], int]:
+    def bench() -> int:
+        samples = 0
+        for text in EXPRESSIONS:
+            graph = mat.GraphY()
+            graph.process_text(text)
+            graph.update_lim_x(-span / 2, span / 2)
+            graph.update_lim_y(-span / 2, span / 2)
+            graph.update_scale(1000 / span, 800 / span)
+            graph.draw()
+            samples += len(graph.line.get_xdata())
+        return samples
+    return bench
+
+
+def make_points_bench(count: int) -> Callable[[], int]:
+    rng = np.random.default_rng(0)
+    points = list(zip(rng.standard_normal(count).tolist(), rng.standard_normal(count).tolist()))
+
+    def bench() -> int:
+        graph = mat.GraphPoints([])
+        graph.set_points(points)
+        graph.draw()
+        return count
+    return bench
+
+
+def make_redraw_bench(num_graphs: int, steps=20) -> Callable[[], int] | None:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+        import ui
+    except ImportError:
+        return None
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = ui.MainWindow()
+    # the window sets up the sandbox and the disk cache in the user's home, the benchmark needs neither
+    mat.expression_cache.sandbox.shutdown()
+    mat.expression_cache.sandbox = None
+    mat.expression_cache.cache_dir = None
+    window.resize(1200, 800)
+    for i in range(num_graphs):
+        window.add_input_field("y")
+        widget = window.input_func_widgets[-1]
+        widget.text.setText(EXPRESSIONS[i % len(EXPRESSIONS)])
+        mat.plot(widget.text.text(), widget.graph, window.ax)
+
+    def bench() -> int:
+        samples = 0
+        for step in range(steps):
+            span = 20 * 1.1 ** (step - steps / 2)
+            window.ax.set_xlim(-span / 2, span / 2)
+            window.ax.set_ylim(-span / 2, span / 2)
+            window.canvas.draw()
+            while window.evaluator.pending:
+                app.processEvents()
+            app.processEvents()
+            samples += sum(len(w.graph.line.get_xdata()) for w in window.input_func_widgets)
+        return samples
+    return bench
+
+
+def make_analysis_bench(num_graphs: int) -> Callable[[], int]:
+    graphs = []
+    for i in range(num_graphs):
+        graph = mat.GraphY()
+        graph.process_text(EXPRESSIONS[i % len(EXPRESSIONS)])
+        graph.update_lim_x(-10, 10)
+        graph.update_lim_y(-10, 10)
+        graph.update_scale(50, 40)
+        graph.draw()
+        graphs.append(graph)
+
+    def bench() -> int:
+        # a new analyzer every time, otherwise everything after the first run comes from its cache
+        roots, extrema, intersections = analysis.Analyzer().analyze(graphs)
+        return len(roots) + len(extrema) + len(intersections)
+    return bench
+
+
+def make_integral_pan_bench() -> Callable[[], int]:
+    source = mat.GraphY()
+    source.process_text(EXPRESSIONS[0])
+    graph = mat.GraphIntegral(source)
+    graph.sync()
+
+    def bench() -> int:
+        # every step moves the view by a tenth, only the new tiles are sampled and summed up
+        samples = 0
+        for step in range(50):
+            graph.update_lim_x(step * 2 - 10, step * 2 + 10)
+            graph.update_lim_y(-10, 10)
+            graph.update_scale(50, 40)
+            graph.draw()
+            samples += len(graph.line.get_xdata())
+        return samples
+    return bench
+
+
+def collect() -> dict[str, Callable[[], Callable[[], int] | None]]:
+    # benchmarks are set up only when they are selected, the redraw ones open a window
+    benches = {
+        "process_text": partial(make_process_text_bench, None),
+        "process_text_disk": lambda: make_process_text_bench(tempfile.mkdtemp(prefix="elmos-bench-")),
+        "process_text_cached": lambda: bench_process_text_cached,
+    }
+    for span in ZOOM_SPANS:
+        benches[f"draw_span_{span:g}"] = partial(make_draw_bench, span)
+    for count in POINT_COUNTS:
+        benches[f"set_points_{count}"] = partial(make_points_bench, count)
+    for num_graphs in REDRAW_GRAPHS:
+        benches[f"analysis_{num_graphs}_graphs"] = partial(make_analysis_bench, num_graphs)
+    benches["integral_pan"] = make_integral_pan_bench
+    for num_graphs in REDRAW_GRAPHS:
+        benches[f"redraw_{num_graphs}_graphs"] = partial(make_redraw_bench, num_graphs)
+    return benches
+
+
+def run(bench: Callable[[], int], repeat: int) -> dict:
+    bench()
+    times = []
+    samples = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        samples = bench()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    bench()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(times)
+    return {
+        "seconds": seconds,
+        "mean_seconds": sum(times) / len(times),
+        "samples": samples,
+        "samples_per_second": samples / seconds if seconds > 0 else None,
+        "peak_memory": peak,
+    }
+
+
+def compare_backends(size=1_000_000, repeat=5) -> dict[str, dict[str, float]]:
+    args = np.linspace(-10, 10, size)
+    table = {}
+    for text in EXPRESSIONS:
+        row = table[text] = {}
+        for backend in backends.BACKENDS:
+            func = mat.expression_cache.compile(text, "x", backend=backend)
+            have_arg = len(inspect.signature(func).parameters) != 0
+            mat.evaluate(func, have_arg, args)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                mat.evaluate(func, have_arg, args)
+                times.append(time.perf_counter() - start)
+            row[backend] = min(times)
+    return table
+
+
+def zoom_memory(text="x*sin(50*x)", steps=1000, report_every=100) -> list[dict]:
+    # the sample cache is disabled, so every zoom step evaluates and masks a fresh sample array
+    graph = mat.GraphY()
+    graph.process_text(text)
+    graph.cache.max_bytes = 0
+    rows = []
+    tracemalloc.start()
+    for step in range(steps):
+        span = 20 * 1.1 ** (step % 40 - 20)
+        graph.update_lim_x(-span / 2, span / 2)
+        graph.update_lim_y(-span / 2, span / 2)
+        graph.update_scale(1000 / span, 800 / span)
+        tracemalloc.reset_peak()
+        graph.draw()
+        if (step + 1) % report_every == 0:
+            current, peak = tracemalloc.get_traced_memory()
+            rows.append({"step": step + 1, "current_memory": current, "step_peak_memory": peak,
+                         "buffer_allocations": graph.buffers.allocations})
+    tracemalloc.stop()
+    return rows
+
+
+def implicit_pole_segments(texts=("y=1/x", "y=tan(x)"), x_mins=(-10.0, -10.3)) -> dict[str, int]:
+    # a segment whose middle is far from zero was drawn across a pole instead of along the curve
+    counts = {}
+    for text in texts:
+        for x_min in x_mins:
+            graph = mat.GraphImplicit()
+            graph.process_text(text)
+            graph.update_lim_x(x_min, x_min + 20)
+            graph.update_lim_y(-10, 10)
+            graph.update_scale(50, 40)
+            x, y = graph.sample()
+            mid = mat.evaluate_2d(graph.func, True, (x[0::3] + x[1::3]) / 2, (y[0::3] + y[1::3]) / 2)
+            counts[f"{text} from x = {x_min:g}"] = int(np.count_nonzero(~(np.abs(mid) < 1)))
+    return counts
+
+
+def jump_connectors(texts=("sign(x)", "Heaviside(x)"), num_points=(201, 2001)) -> dict[str, int]:
+    # on a symmetric grid one sample lands right on the jump at 0
+    counts = {}
+    for text in texts:
+        graph = mat.GraphY()
+        graph.process_text(text)
+        for n in num_points:
+            x = np.linspace(-1, 1, n)
+            x, y = mat.break_discontinuities(x, graph.values(x), None)
+            counts[f"{text} on {n} points"] = int(np.count_nonzero(np.abs(np.diff(y)) > 0.25))
+    return counts
+
+
+def integral_errors(exact=(("x^3", 0.25), ("x**2", 1 / 3), ("floor(x)", None))) -> dict[str, float]:
+    # the integral from 0 must not depend on the views it was drawn in before, steps only get checked at 0
+    # because simpson is off by a grid step where a jump falls on a sample
+    errors = {}
+    for text, at_one in exact:
+        source = mat.GraphY()
+        source.process_text(text)
+        graph = mat.GraphIntegral(source)
+        graph.sync()
+        for x_min, x_max in ((-10, 10), (-1, 1), (-17, 3), (-1, 1)):
+            graph.update_lim_x(x_min, x_max)
+            graph.update_lim_y(-5, 5)
+            graph.update_scale(1000 / (x_max - x_min), 80)
+            x, y = graph.sample()
+            if x_min == -10:
+                errors[f"{text} at the default view"] = float(abs(np.interp(0.0, x, y)))
+        error = abs(np.interp(0.0, x, y))
+        if at_one is not None:
+            error = max(error, abs(np.interp(1.0, x, y) - at_one))
+        errors[f"{text} after a pan"] = float(error)
+    return errors
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["seconds"] > base["seconds"] * (1 + tolerance):
+            regressions.append(f"{name}: {base['seconds'] * 1000:.2f} ms -> {result['seconds'] * 1000:.2f} ms")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Elmos drawing hot paths")
+    parser.add_argument("-k", "--only", help="run only benchmarks whose name contains this text")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-o", "--out", default="bench_results.json", help="JSON file for the results")
+    parser.add_argument("-b", "--baseline", help="JSON results to compare against")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    parser.add_argument("--backends", action="store_true", help="compare evaluation backends per expression")
+    parser.add_argument("--memory", action="store_true", help="track memory across 1000 zoom steps")
+    parser.add_argument("--check", action="store_true", help="check poles, jumps and integrals")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        counts = implicit_pole_segments()
+        for name, count in counts.items():
+            print(f"{name:28s} {count:6d} segments across poles")
+        for name, count in jump_connectors().items():
+            counts[name] = count
+            print(f"{name:28s} {count:6d} segments across jumps")
+        errors = integral_errors()
+        for name, error in errors.items():
+            print(f"{name:28s} {error:10.2e} integral error")
+        return 1 if any(counts.values()) or max(errors.values()) > 1e-6 else 0
+
+    if args.memory:
+        rows = zoom_memory()
+        for row in rows:
+            print(f"step {row['step']:5d}  {row['current_memory'] / 2 ** 10:10.1f} KiB  "
+                  f"peak {row['step_peak_memory'] / 2 ** 10:10.1f} KiB  {row['buffer_allocations']:4d} allocations")
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "numpy": np.__version__, "memory": rows}, f, indent=2)
+        return 0
+
+    if args.backends:
+        table = compare_backends(repeat=args.repeat)
+        print(f"{'expression':32s}" + "".join(f"{backend:>18s}" for backend in backends.BACKENDS))
+        for text, row in table.items():
+            print(f"{text:32s}" + "".join(f"{row[backend] * 1000:9.2f} ms {row['numpy'] / row[backend]:5.2f}x"
+                                          for backend in backends.BACKENDS))
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "numpy": np.__version__, "backends": table}, f, indent=2)
+        return 0
+
+    results = {}
+    for name, setup in collect().items():
+        if args.only and args.only not in name:
+            continue
+        # compilation is measured locally and cold, without the sandbox or the user's disk cache
+        mat.expression_cache.sandbox = None
+        mat.expression_cache.cache_dir = None
+        bench = setup()
+        if bench is None:
+            continue
+        results[name] = result = run(bench, args.repeat)
+        rate = result["samples_per_second"]
+        print(f"{name:28s} {result['seconds'] * 1000:10.2f} ms  "
+              f"{rate if rate is not None else 0:14,.0f} samples/s  {result['peak_memory'] / 2 ** 20:8.2f} MiB")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"python": platform.python_version(), "numpy": np.__version__, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import math
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+
+import numpy as np
+
+import mat
+
+
+class Evaluator:
+    def __init__(self, max_workers: int | None = None, use_processes=False):
+        self.workers = max_workers or os.cpu_count() or 1
+        self.__threads = ThreadPoolExecutor(max_workers)
+        self.__processes = ProcessPoolExecutor(max_workers) if use_processes else None
+        self.__pending: dict[mat.FuncGraph, tuple[int, Future]] = {}
+        self.__generation = 0
+        self.__lock = threading.Lock()
+        self.dropped = 0
+
+    def submit(self, graph: mat.FuncGraph, callback: Callable[[mat.FuncGraph, tuple[np.ndarray, np.ndarray]], None]):
+        return self.submit_batch([graph], callback)[0]
+
+    def submit_batch(self, graphs: list[mat.FuncGraph],
+                     callback: Callable[[mat.FuncGraph, tuple[np.ndarray, np.ndarray]], None]) -> list[Future]:
+        groups: dict[tuple, list[tuple[mat.FuncGraph, tuple]]] = {}
+        for graph in graphs:
+            viewport = graph.viewport()
+            groups.setdefault(grid_key(graph, viewport), []).append((graph, viewport))
+
+        futures = []
+        with self.__lock:
+            self.__generation += 1
+            generation = self.__generation
+            superseded = [self.__pending.pop(graph) for graph in graphs if graph in self.__pending]
+            alive = {id(future) for _, future in self.__pending.values()}
+            for _, future in superseded:
+                if id(future) not in alive and future.cancel():
+                    self.dropped += 1
+
+            # a group shares its grids, so it is split into one task per worker rather than one per graph
+            for group in groups.values():
+                size = math.ceil(len(group) / self.workers)
+                for start in range(0, len(group), size):
+                    chunk = group[start:start + size]
+                    futures.append(([graph for graph, _ in chunk], self.__submit_chunk(chunk, generation)))
+
+        # a task that is already finished runs its callback right away, which takes the lock again
+        for chunk_graphs, future in futures:
+            future.add_done_callback(partial(self.__done, chunk_graphs, generation, callback))
+        return [future for _, future in futures]
+
+    def __submit_chunk(self, chunk: list[tuple[mat.FuncGraph, tuple]], generation: int) -> Future:
+        chunk_graphs = [graph for graph, _ in chunk]
+        # lambdified functions cannot be pickled, so worker processes compile the text themselves
+        if self.__processes is not None and all(graph.text is not None for graph in chunk_graphs):
+            future = self.__processes.submit(sample_expressions, [
+                (graph.graph_type, graph.text, viewport, graph.backend, graph.params, graph.family)
+                for graph, viewport in chunk
+            ])
+        else:
+            future = self.__threads.submit(sample_batch, chunk)
+        for graph in chunk_graphs:
+            self.__pending[graph] = (generation, future)
+        return future
+
+    @property
+    def pending(self) -> int:
+        with self.__lock:
+            return len(self.__pending)
+
+    def cancel(self, graph: mat.FuncGraph):
+        with self.__lock:
+            pending = self.__pending.pop(graph, None)
+            if pending is None or any(future is pending[1] for _, future in self.__pending.values()):
+                return
+        pending[1].cancel()
+
+    def shutdown(self):
+        self.__threads.shutdown(wait=False, cancel_futures=True)
+        if self.__processes is not None:
+            self.__processes.shutdown(wait=False, cancel_futures=True)
+
+    def __done(self, graphs: list[mat.FuncGraph], generation: int, callback: Callable, future: Future):
+        current = []
+        with self.__lock:
+            for i, graph in enumerate(graphs):
+                pending = self.__pending.get(graph)
+                if pending is None or pending[0] != generation:
+                    if not future.cancelled():
+                        self.dropped += 1
+                    continue
+                del self.__pending[graph]
+                current.append(i)
+        if not current or future.cancelled() or future.exception() is not None:
+            return
+        results = future.result()
+        for i in current:
+            if results[i] is not None:
+                callback(graphs[i], results[i])
+
+
+def grid_key(graph: mat.FuncGraph, viewport: tuple[mat.DynamicRange, mat.DynamicRange, float, float]) -> tuple:
+    lim_x, lim_y, scale_x, scale_y = viewport
+    match graph.arg_axis:
+        case 0:
+            return 0, lim_x.min, lim_x.max, scale_x
+        case 1:
+            return 1, lim_y.min, lim_y.max, scale_y
+    return graph.graph_type, lim_x.min, lim_x.max, lim_y.min, lim_y.max, scale_x, scale_y
+
+
+def sample_batch(chunk: list[tuple[mat.FuncGraph, tuple[mat.DynamicRange, mat.DynamicRange, float, float]]]) -> list:
+    results = []
+    for graph, viewport in chunk:
+        try:
+            results.append(graph.sample(viewport))
+        except Exception:
+            results.append(None)
+    return results
+
+
+_worker_graphs: dict[tuple[mat.GraphType, str, str], mat.FuncGraph] = {}
+
+
+def sample_expression(graph_type: mat.GraphType, text: str,
+                      viewport: tuple[mat.DynamicRange, mat.DynamicRange, float, float], backend="numpy",
+                      params: dict[str, float] = None, family: str | None = None):
+    graph = _worker_graphs.get((graph_type, text, backend))
+    if graph is None:
+        graph = mat.create_graph(graph_type)
+        graph.backend = backend
+        graph.process_text(text)
+        if graph.func is None:
+            raise ValueError(f"Wrong function: {text}")
+        if len(_worker_graphs) >= 64:
+            _worker_graphs.clear()
+        _worker_graphs[(graph_type, text, backend)] = graph
+    for name, value in (params or {}).items():
+        graph.set_param(name, value)
+    graph.set_family(family)
+    return graph.sample(viewport)
+
+
+def sample_expressions(specs: list[tuple[mat.GraphType, str, tuple, str, dict[str, float], str | None]]) -> list:
+    results = []
+    for spec in specs:
+        try:
+            results.append(sample_expression(*spec))
+        except Exception:
+            results.append(None)
+    return results
@@ -1,17 +1,30 @@
+import builtins
+import hashlib
+import importlib
 import inspect
+import json
+import math
+import os
 import re
+import threading
+import time
 import traceback
 from enum import Enum
+from functools import lru_cache, partial
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from typing import Callable
 
-import sympy as sm
 import numpy as np
 import random as rand
 
 from matplotlib.axes import Axes
+from matplotlib.collections import LineCollection
 from matplotlib.lines import Line2D
 
+from profiling import profiler
+from sandbox import ExpressionLimitError, Sandbox
+
 
 def logb(x, b):
     return np.log(x) / np.log(b)
@@ -23,10 +36,166 @@ def custom_pow(base, exp):
 
 modules = ["numpy", {"logb": logb, "^": custom_pow}]
 
+
+def preload_sympy() -> threading.Thread:
+    thread = threading.Thread(target=importlib.import_module, args=("backends",), daemon=True)
+    thread.start()
+    return thread
+
+
+class ExpressionCache:
+    # never parameters: a y in a function of x is a wrong function, not a slider
+    variables = ("x", "y")
+
+    def __init__(self, max_size=256, cache_dir: str | None = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.sandbox: Sandbox | None = None
+        self.__funcs: OrderedDict[tuple, Callable] = OrderedDict()
+
+    def clear(self):
+        self.__funcs.clear()
+
+    def compile(self, text: str, var: str, mods: list = None, backend="numpy") -> Callable:
+        mods = modules if mods is None else mods
+        key = (re.sub(r"\s+", "", text), var, self.__modules_key(mods), backend)
+
+        func = self.__funcs.get(key)
+        if func is not None:
+            self.hits += 1
+            self.__funcs.move_to_end(key)
+            return func
+
+        self.misses += 1
+        func = self.__load(key, mods)
+        if func is not None:
+            self.disk_hits += 1
+        elif self.sandbox is not None:
+            # new text is parsed and evaluated once in the sandbox first, which also stores it on disk
+            with profiler.stage("sandbox"):
+                self.sandbox.check(key[0], var, mods, backend, self.cache_dir)
+            func = self.__load(key, mods)
+        if func is None:
+            # sympy takes longer to import than the rest of the app, so it is only loaded when needed
+            with profiler.stage("import sympy"):
+                import sympy as sm
+                import backends
+            with profiler.stage("sympify"):
+                sympy_expr = sm.sympify(key[0])
+            # symbols other than the variables become parameters, passed after them
+            symbols = sm.symbols(var, seq=True)
+            stray = sorted(s.name for s in sympy_expr.free_symbols if s.name in self.variables and s not in symbols)
+            if stray:
+                raise ValueError(f"{', '.join(stray)} is not a variable of {key[0]}")
+            params = tuple(sorted((s for s in sympy_expr.free_symbols if s not in symbols), key=str))
+            with profiler.stage("lambdify"):
+                func, used = backends.compile_expression(sympy_expr, symbols + params, mods, backend)
+            func.params = tuple(map(str, params))
+            if used == "numpy":
+                self.__save(key, mods, func)
+
+        self.__funcs[key] = func
+        if len(self.__funcs) > self.max_size:
+            self.__funcs.popitem(last=False)
+        return func
+
+    @staticmethod
+    def __modules_key(mods: list) -> tuple:
+        return tuple(m if isinstance(m, str) else tuple(sorted(m)) for m in mods)
+
+    @staticmethod
+    def __resolve(name: str, mods: list):
+        for m in reversed(mods):
+            if isinstance(m, dict) and name in m:
+                return m[name]
+        if hasattr(np, name):
+            return getattr(np, name)
+        return getattr(builtins, name, None)
+
+    def __path(self, key: tuple) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".json")
+
+    def __load(self, key: tuple, mods: list) -> Callable | None:
+        if self.cache_dir is None or "numpy" not in mods:
+            return None
+        try:
+            with open(self.__path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry["key"] != json.loads(json.dumps(key)):
+                return None
+            namespace = {}
+            for name in entry["names"]:
+                value = self.__resolve(name, mods)
+                if value is None:
+                    return None
+                namespace[name] = value
+            if any(name in self.variables for name in entry["params"]):
+                return None
+            exec(entry["source"], namespace)
+            func = namespace[entry["func"]]
+            func.params = tuple(entry["params"])
+            return func
+        except (OSError, ValueError, KeyError, SyntaxError):
+            return None
+
+    def __save(self, key: tuple, mods: list, func: Callable):
+        if self.cache_dir is None or "numpy" not in mods:
+            return
+        names = func.__code__.co_names
+        # only functions whose globals can be rebuilt from numpy and the custom modules are stored
+        if any(self.__resolve(name, mods) is not func.__globals__.get(name, getattr(builtins, name, None))
+               for name in names):
+            return
+        try:
+            entry = {"key": key, "func": func.__name__, "names": names, "params": func.params,
+                     "source": inspect.getsource(func)}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self.__path(key)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(path + ".tmp", path)
+        except (OSError, TypeError):
+            pass
+
+
+expression_cache = ExpressionCache()
+
+
+@lru_cache(maxsize=256)
+def derivative_text(text: str, var: str) -> str:
+    # one symbolic differentiation per expression, the result is compiled like any typed expression
+    if expression_cache.sandbox is not None:
+        return expression_cache.sandbox.derivative(text, var)
+    return differentiate(text, var)
+
+
+def differentiate(text: str, var: str) -> str:
+    import sympy as sm
+    expr = sm.sympify(re.sub(r"\s+", "", text), locals={"logb": lambda x, b: sm.log(x) / sm.log(b)})
+    # real symbols keep the derivatives of Abs and sign free of re() and im()
+    expr = expr.subs({symbol: sm.Symbol(symbol.name, real=True) for symbol in expr.free_symbols})
+    derivative = sm.diff(expr, sm.Symbol(var, real=True))
+    # steps are flat everywhere but at the jump, which is not drawn anyway
+    derivative = derivative.replace(sm.DiracDelta, lambda *args: sm.S.Zero)
+    derivative = derivative.replace(
+        lambda e: isinstance(e, sm.Derivative) and isinstance(e.expr, (sm.floor, sm.ceiling)), lambda e: sm.S.Zero)
+    derivative = derivative.replace(lambda e: isinstance(e, sm.Subs), lambda e: e.doit())
+    if derivative.has(sm.Derivative):
+        raise ValueError(f"no derivative of {text}")
+    return str(derivative)
+
+
 class GraphType(Enum):
     X = "x"
     Y = "y"
     POINTS = "points"
+    IMPLICIT = "implicit"
+    DERIVATIVE = "derivative"
+    INTEGRAL = "integral"
 
 
 class DynamicRange:
@@ -46,6 +215,159 @@ class DynamicRange:
         else:
             return self.min <= num <= self.max
 
+    def copy(self):
+        return DynamicRange(self.min, self.min_is_dynamic, self.max, self.max_is_dynamic)
+
+    def mask(self, values: np.ndarray) -> np.ndarray:
+        mask = np.ones(np.shape(values), dtype=bool)
+        with np.errstate(invalid="ignore"):
+            if self.min is not None:
+                mask &= values >= self.min
+            if self.max is not None:
+                mask &= values <= self.max
+        return mask
+
+    def clip(self, values: np.ndarray) -> np.ndarray:
+        return np.where(self.mask(values), values, np.nan)
+
+    def clip_inplace(self, values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid="ignore"):
+            if self.min is not None:
+                np.less(values, self.min, out=mask)
+                np.copyto(values, np.nan, where=mask)
+            if self.max is not None:
+                np.greater(values, self.max, out=mask)
+                np.copyto(values, np.nan, where=mask)
+        return values
+
+    def span(self) -> float | None:
+        if self.min is None or self.max is None:
+            return None
+        return abs(self.max - self.min)
+
+    def intersect(self, _min: float, _max: float):
+        lim = self.copy()
+        lim.min = _min if lim.min is None else min(max(lim.min, _min), _max)
+        lim.max = _max if lim.max is None else max(min(lim.max, _max), lim.min)
+        return lim
+
+
+class SampleBuffers:
+    def __init__(self):
+        # two sets of buffers, so the arrays handed to Line2D are not overwritten by the next sample
+        self.__slots: list[dict[str, np.ndarray]] = [{}, {}]
+        self.__current = 0
+        self.allocations = 0
+
+    def swap(self):
+        self.__current ^= 1
+
+    def get(self, name: str, size: int, dtype=np.float64) -> np.ndarray:
+        slot = self.__slots[self.__current]
+        array = slot.get(name)
+        if array is None or len(array) < size:
+            array = np.empty(max(size, 2 * len(array)) if array is not None else size, dtype=dtype)
+            slot[name] = array
+            self.allocations += 1
+        return array[:size]
+
+
+class SampleCache:
+    tile_px = 256
+    tile_max_points = 8192
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__tiles: OrderedDict[tuple[int, int, int], tuple[np.ndarray, np.ndarray]] = OrderedDict()
+        self.__window: DynamicRange | None = None
+        self.__lock = threading.Lock()
+
+    def clear(self):
+        with self.__lock:
+            self.__tiles.clear()
+            self.__window = None
+            self.bytes = 0
+
+    def sample(self, func: Callable, arg_min: float, arg_max: float, arg_scale: float, val_scale: float,
+               val_lim: DynamicRange, buffers: SampleBuffers = None):
+        with self.__lock:
+            return self.__sample(func, arg_min, arg_max, arg_scale, val_scale, val_lim,
+                                 SampleBuffers() if buffers is None else buffers)
+
+    def __sample(self, func: Callable, arg_min: float, arg_max: float, arg_scale: float, val_scale: float,
+                 val_lim: DynamicRange, buffers: SampleBuffers):
+        # tiles are sampled in a fixed clamp window, so a vertical pan out of it makes them stale
+        if not self.__window_contains(val_lim):
+            self.__tiles.clear()
+            self.bytes = 0
+            margin = val_lim.span() or 0
+            self.__window = DynamicRange(
+                val_lim.min - margin if val_lim.min is not None else None, False,
+                val_lim.max + margin if val_lim.max is not None else None, False
+            )
+
+        arg_level, tile_width = self.level(arg_scale)
+        val_level = math.ceil(2 * math.log2(val_scale))
+        level_scale = 2 ** (arg_level / 2)
+
+        first = math.floor(arg_min / tile_width)
+        last = math.floor(arg_max / tile_width)
+        parts = []
+        for index in range(first, last + 1):
+            tile_args, tile_vals = self.__tile(func, (arg_level, val_level, index), tile_width, level_scale,
+                                               2 ** (val_level / 2))
+            # neighbouring tiles share their edge sample, and the outer tiles are trimmed to the view
+            lo = max(np.searchsorted(tile_args, arg_min, "right"), 0 if index == first else 1)
+            hi = np.searchsorted(tile_args, arg_max, "left")
+            parts.append((tile_args, tile_vals, lo, max(hi, lo)))
+
+        size = 2 + sum(hi - lo for _, _, lo, hi in parts)
+        args, vals = buffers.get("args", size), buffers.get("vals", size)
+        pos = 1
+        for tile_args, tile_vals, lo, hi in parts:
+            args[pos:pos + hi - lo] = tile_args[lo:hi]
+            vals[pos:pos + hi - lo] = tile_vals[lo:hi]
+            pos += hi - lo
+        args[0], args[-1] = arg_min, arg_max
+        vals[[0, -1]] = func(args[[0, -1]])
+        return args, vals
+
+    @classmethod
+    def level(cls, arg_scale: float) -> tuple[int, float]:
+        # zoom levels are quantized in half-octave steps, rounded up so tiles are never coarser than the view
+        arg_level = math.ceil(2 * math.log2(arg_scale))
+        return arg_level, cls.tile_px / 2 ** (arg_level / 2)
+
+    def __window_contains(self, val_lim: DynamicRange):
+        if self.__window is None:
+            return False
+        if (self.__window.min is None) != (val_lim.min is None) or (self.__window.max is None) != (val_lim.max is None):
+            return False
+        return ((val_lim.min is None or val_lim.min >= self.__window.min) and
+                (val_lim.max is None or val_lim.max <= self.__window.max))
+
+    def __tile(self, func: Callable, key: tuple[int, int, int], tile_width: float, arg_scale: float,
+               val_scale: float):
+        tile = self.__tiles.get(key)
+        if tile is not None:
+            self.hits += 1
+            self.__tiles.move_to_end(key)
+            return tile
+
+        self.misses += 1
+        index = key[2]
+        tile = adaptive_sample(func, index * tile_width, (index + 1) * tile_width, arg_scale, val_scale,
+                               self.__window, max_points=self.tile_max_points)
+        self.__tiles[key] = tile
+        self.bytes += tile[0].nbytes + tile[1].nbytes
+        while self.bytes > self.max_bytes and len(self.__tiles) > 1:
+            _, (old_args, old_vals) = self.__tiles.popitem(last=False)
+            self.bytes -= old_args.nbytes + old_vals.nbytes
+        return tile
+
 
 class AbstractGraph(ABC):
     __colors = ['#4242fd', '#008000', '#ff0000', '#2dbbbb', '#be08be', '#b9b93d', '#000000']
@@ -56,6 +378,10 @@ class AbstractGraph(ABC):
         super().__init__()
         self.graph_type = graph_type
         self.line = Line2D([], [], color=rand.choice(self.__colors))
+        self.version = 0
+
+    def state(self) -> tuple:
+        return (self.version,)
 
     @abstractmethod
     def draw(self):
@@ -72,14 +398,29 @@ class LimGraph(AbstractGraph, ABC):
         super().__init__(graph_type)
         self.lim_x = lim_x if lim_x is not None else DynamicRange(None, True, None, True)
         self.lim_y = lim_y if lim_y is not None else DynamicRange(None, True, None, True)
+        self.scale_x = 50.0
+        self.scale_y = 50.0
+        # the axes' visible range, fixed limits can reach far beyond it
+        self.view_x: tuple[float, float] | None = None
+        self.view_y: tuple[float, float] | None = None
+
+    def state(self) -> tuple:
+        return (self.version, self.lim_x.min, self.lim_x.max, self.lim_y.min, self.lim_y.max,
+                self.scale_x, self.scale_y, self.view_x, self.view_y)
+
+    def update_scale(self, scale_x: float, scale_y: float):
+        self.scale_x = scale_x
+        self.scale_y = scale_y
 
     def update_lim_x(self, _min: float, _max: float):
+        self.view_x = (_min, _max)
         if self.lim_x.min_is_dynamic:
             self.lim_x.min = _min
         if self.lim_x.max_is_dynamic:
             self.lim_x.max = _max
 
     def update_lim_y(self, _min: float, _max: float):
+        self.view_y = (_min, _max)
         if self.lim_y.min_is_dynamic:
             self.lim_y.min = _min
         if self.lim_y.max_is_dynamic:
@@ -87,8 +428,25 @@ class LimGraph(AbstractGraph, ABC):
 
 
 class FuncGraph(LimGraph, ABC):
-    def __init__(self, graph_type: GraphType, func: Callable = None, lim_x: DynamicRange = None, lim_y: DynamicRange = None):
+    param_range = (-10.0, 10.0)
+    family_size = 20
+    # 0 if the argument is drawn along x, 1 if along y, None for graphs of two variables
+    arg_axis: int | None = None
+
+    def __init__(self, graph_type: GraphType, func: Callable = None, lim_x: DynamicRange = None,
+                 lim_y: DynamicRange = None):
         super().__init__(graph_type, lim_x, lim_y)
+        self.cache = SampleCache()
+        self.buffers = SampleBuffers()
+        self.text: str | None = None
+        self.backend = "numpy"
+        self.__sample_lock = threading.Lock()
+        self.__func = None
+        self._have_arg = False
+        self.params: dict[str, float] = {}
+        self.sample_time = 0.0
+        self.family: str | None = None
+        self.collection: LineCollection | None = None
         self.func = func
 
     @property
@@ -97,123 +455,920 @@ class FuncGraph(LimGraph, ABC):
 
     @func.setter
     def func(self, func: Callable):
+        if func is self.__func:
+            return
         self.__func = func
         if func is not None:
             self._have_arg = len(inspect.signature(func).parameters.keys()) != 0
         else:
             self._have_arg = False
+        self.params = {name: self.params.get(name, 1.0) for name in getattr(func, "params", ())}
+        if self.family not in self.params:
+            self.family = None
+        # a new cache object keeps samples of the old function computed in the background out of it,
+        # it is replaced last because _evaluator reads it first
+        self.cache = SampleCache(self.cache.max_bytes)
+        self.version += 1
 
+    def set_param(self, name: str, value: float):
+        if self.params.get(name) == value:
+            return
+        self.params = {**self.params, name: value}
+        self.cache = SampleCache(self.cache.max_bytes)
+        self.version += 1
 
-class GraphY(FuncGraph):
-    def __init__(self, func: Callable = None, lim_x: DynamicRange = None, lim_y: DynamicRange = None):
-        super().__init__(GraphType.Y, func, lim_x, lim_y)
+    def set_family(self, name: str | None):
+        if name == self.family:
+            return
+        self.family = name
+        if name is not None and self.collection is None:
+            self.collection = LineCollection([], colors=self.line.get_color(), linewidths=self.line.get_linewidth())
+        self.version += 1
+
+    def family_values(self) -> np.ndarray:
+        return np.linspace(*self.param_range, self.family_size)
+
+    @property
+    def label(self) -> str:
+        return f"{self.graph_type.value} = {self.text}"
+
+    def viewport(self) -> tuple[DynamicRange, DynamicRange, float, float]:
+        # the argument is only sampled where it can be seen, at the view's density a fixed limit far outside
+        # of it would take millions of points
+        lim_x, lim_y = self.lim_x.copy(), self.lim_y.copy()
+        if self.arg_axis != 1 and self.view_x is not None:
+            lim_x = lim_x.intersect(*self.__visible(self.view_x))
+        if self.arg_axis != 0 and self.view_y is not None:
+            lim_y = lim_y.intersect(*self.__visible(self.view_y))
+        return lim_x, lim_y, self.scale_x, self.scale_y
+
+    @staticmethod
+    def __visible(view: tuple[float, float], margin=0.25) -> tuple[float, float]:
+        low, high = min(view), max(view)
+        pad = (high - low) * margin
+        return low - pad, high + pad
 
     def draw(self):
         try:
             if self.func is not None:
-                num_points = calculate_num_points(self.lim_x.min, self.lim_x.max)
-                x_vals = np.linspace(self.lim_x.min, self.lim_x.max, num_points)
-                y_vals = self.func(x_vals) if self._have_arg else [self.func()] * len(x_vals)
-                y_vals = np.where([self.lim_y.in_range(y) for y in y_vals], y_vals, np.nan)
-                self.line.set_data(x_vals, y_vals)
+                data = self.sample()
+                with profiler.stage("set_data", self.label):
+                    self.set_data(data)
         except Exception as e:
             pass
 
+    def set_data(self, data):
+        # a family comes as one array of segments, a single curve as a pair of arrays
+        if isinstance(data, np.ndarray):
+            self.line.set_data([], [])
+            self.collection.set_segments(data)
+        else:
+            if self.collection is not None:
+                self.collection.set_segments([])
+            self.line.set_data(*data)
+
+    def sample(self, viewport: tuple[DynamicRange, DynamicRange, float, float] = None):
+        with self.__sample_lock:
+            start = time.perf_counter()
+            self.buffers.swap()
+            data = self._sample(self.viewport() if viewport is None else viewport)
+            self.sample_time = time.perf_counter() - start
+            return data
+
+    @abstractmethod
+    def _sample(self, viewport: tuple[DynamicRange, DynamicRange, float, float]):
+        pass
+
+    def values(self, args: np.ndarray) -> np.ndarray:
+        return evaluate(self._bound_func(), self._have_arg, args)
+
+    def _evaluator(self) -> tuple[Callable, SampleCache]:
+        cache = self.cache
+        return partial(evaluate, self._bound_func(), self._have_arg), cache
+
+    def _bound_func(self) -> Callable:
+        func, params = self.__func, tuple(self.params.values())
+        if not params:
+            return func
+        return lambda *args: func(*args, *params)
+
+    def _sample_curve(self, viewport: tuple[DynamicRange, DynamicRange, float, float], arg_axis: int):
+        lim_x, lim_y, scale_x, scale_y = viewport
+        arg_lim, arg_scale, val_lim, val_scale = ((lim_x, scale_x, lim_y, scale_y) if arg_axis == 0
+                                                  else (lim_y, scale_y, lim_x, scale_x))
+        family = self.family
+        if family is not None:
+            with profiler.graph(self.label), profiler.stage("evaluate"):
+                return self._sample_family(family, arg_lim, arg_scale, val_lim, arg_axis)
+
+        func, cache = self._evaluator()
+        with profiler.graph(self.label):
+            with profiler.stage("evaluate"):
+                args, vals = cache.sample(func, arg_lim.min, arg_lim.max, arg_scale, val_scale, val_lim, self.buffers)
+            with profiler.stage("mask"):
+                val_lim.clip_inplace(vals, self.buffers.get("mask", len(vals), bool))
+                args, vals = break_discontinuities(args, vals, val_lim.span(), self.buffers)
+            with profiler.stage("decimate"):
+                args, vals = decimate(args, vals, arg_lim.min, arg_lim.max, (arg_lim.max - arg_lim.min) * arg_scale)
+        return (args, vals) if arg_axis == 0 else (vals, args)
+
+    def _sample_family(self, family: str, arg_lim: DynamicRange, arg_scale: float, val_lim: DynamicRange,
+                       arg_axis: int) -> np.ndarray:
+        # all members are evaluated in one broadcast call, on a grid of one point per pixel
+        values = self.family_values()
+        num_points = max(int((arg_lim.max - arg_lim.min) * arg_scale), 2) + 1
+        args = coarse_grid(float(arg_lim.min), float(arg_lim.max), num_points)
+        columns = [values[:, None] if name == family else value for name, value in self.params.items()]
+        with np.errstate(all="ignore"):
+            vals = np.full((len(values), num_points), self.__func(args[None, :], *columns), dtype=float)
+        val_lim.clip_inplace(vals, np.empty(vals.shape, dtype=bool))
+        break_rows(vals, val_lim.span())
+
+        segments = np.empty(vals.shape + (2,))
+        segments[..., arg_axis] = args
+        segments[..., 1 - arg_axis] = vals
+        return segments
+
+
+def evaluate(func: Callable, have_arg: bool, args: np.ndarray) -> np.ndarray:
+    if not have_arg:
+        return np.full(len(args), func(), dtype=float)
+    with np.errstate(all="ignore"):
+        vals = func(args)
+    if np.ndim(vals) == 0:
+        return np.full(len(args), vals, dtype=float)
+    return np.asarray(vals, dtype=float)
+
+
+class GraphY(FuncGraph):
+    arg_axis = 0
+
+    def __init__(self, func: Callable = None, lim_x: DynamicRange = None, lim_y: DynamicRange = None):
+        super().__init__(GraphType.Y, func, lim_x, lim_y)
+
+    def _sample(self, viewport: tuple[DynamicRange, DynamicRange, float, float]):
+        return self._sample_curve(viewport, 0)
+
     def process_text(self, text: str):
         try:
-            sympy_expr = sm.sympify(text)
-            x = sm.symbols("x")
-            if x in sympy_expr.free_symbols:
-                self.func = sm.lambdify(x, sympy_expr, modules)
-            else:
-                self.func = sm.lambdify([], sympy_expr, modules)
+            with profiler.graph(f"{self.graph_type.value} = {text}"):
+                self.func = expression_cache.compile(text, "x", backend=self.backend)
+            self.text = text
+        except ExpressionLimitError:
+            raise
         except Exception as e:
             traceback.print_exception(e)
 
 
 class GraphX(FuncGraph):
+    arg_axis = 1
 
     def __init__(self, func: Callable = None, lim_x: DynamicRange = None, lim_y: DynamicRange = None):
         super().__init__(GraphType.X, func, lim_x, lim_y)
 
-    def draw(self):
-        try:
-            if self.func is not None:
-                num_points = calculate_num_points(self.lim_y.min, self.lim_y.max)
-                y_vals = np.linspace(self.lim_y.min, self.lim_y.max, num_points)
-                x_vals = self.func(y_vals) if self._have_arg else [self.func()] * len(y_vals)
-                x_vals = np.where([self.lim_x.in_range(x) for x in x_vals], x_vals, np.nan)
-                self.line.set_data(x_vals, y_vals)
-        except:
-            pass
+    def _sample(self, viewport: tuple[DynamicRange, DynamicRange, float, float]):
+        return self._sample_curve(viewport, 1)
 
     def process_text(self, text: str):
-        sympy_expr = sm.sympify(text)
-        y = sm.symbols("y")
-        if y in sympy_expr.free_symbols:
-            self.func = sm.lambdify(y, sympy_expr, modules)
-        else:
-            self.func = sm.lambdify([], sympy_expr, modules)
+        with profiler.graph(f"{self.graph_type.value} = {text}"):
+            self.func = expression_cache.compile(text, "y", backend=self.backend)
+        self.text = text
+
+
+class DerivedGraph(FuncGraph, ABC):
+    # a graph computed from another curve, it follows the source's function, parameters and axis
+    def __init__(self, graph_type: GraphType, source: FuncGraph | None = None):
+        super().__init__(graph_type)
+        self.source = source
+
+    @property
+    def arg_axis(self) -> int | None:
+        return None if self.source is None else self.source.arg_axis
+
+    @property
+    def var(self) -> str:
+        return "y" if self.arg_axis == 1 else "x"
+
+    def process_text(self, text: str):
+        # there is nothing to type in, the text is taken from the source
+        self.sync()
+
+    @abstractmethod
+    def sync(self):
+        pass
+
+    def _follow(self, with_family: bool):
+        source = self.source
+        for name, value in source.params.items():
+            if name in self.params:
+                self.set_param(name, value)
+        self.set_family(source.family if with_family and source.family in self.params else None)
+
+
+class GraphDerivative(DerivedGraph):
+    def __init__(self, source: FuncGraph | None = None):
+        super().__init__(GraphType.DERIVATIVE, source)
+        self.__key = None
+
+    @property
+    def label(self) -> str:
+        if self.source is None or self.source.text is None:
+            return ""
+        return f"d/d{self.var} ({self.source.text})"
+
+    def sync(self):
+        source = self.source
+        # the derivative is taken once per source expression, params only change its arguments
+        key = (source.text, source.arg_axis, self.backend)
+        if key != self.__key:
+            self.__key = key
+            self.func = None
+            if source.text is not None and source.arg_axis is not None:
+                with profiler.graph(self.label):
+                    self.func = expression_cache.compile(derivative_text(source.text, self.var), self.var,
+                                                         backend=self.backend)
+        self._follow(True)
+
+    def _sample(self, viewport: tuple[DynamicRange, DynamicRange, float, float]):
+        return self._sample_curve(viewport, self.arg_axis)
+
+
+class GraphIntegral(DerivedGraph):
+    tile_intervals = 512
+    max_tiles = 256
+    max_anchors = 65536
+    max_walk_tiles = 64
+    max_offset_points = 2 ** 20
+
+    def __init__(self, source: FuncGraph | None = None):
+        super().__init__(GraphType.INTEGRAL, source)
+        # the integrand gets a uniform simpson grid per tile of its own, the source's tiles are only refined where
+        # the curve is visible, which is not enough for a running sum
+        self.__tiles: OrderedDict[tuple[int, int], tuple[np.ndarray, np.ndarray, float]] = OrderedDict()
+        # running integrals at the tile edges of every zoom level, so a pan only adds up the tiles that came into view
+        self.__anchors: dict[tuple[int, int], float] = {}
+        self.__source_cache: SampleCache | None = None
+
+    @property
+    def label(self) -> str:
+        if self.source is None or self.source.text is None:
+            return ""
+        return f"∫ {self.source.text} d{self.var}"
+
+    def sync(self):
+        self.func = self.source.func
+        self._follow(False)
+
+    def _sample(self, viewport: tuple[DynamicRange, DynamicRange, float, float]):
+        lim_x, lim_y, scale_x, scale_y = viewport
+        arg_axis = self.arg_axis
+        arg_lim, arg_scale, val_lim = ((lim_x, scale_x, lim_y) if arg_axis == 0 else (lim_y, scale_y, lim_x))
+        # the source's cache is replaced whenever its function or parameters change
+        func, cache = self.source._evaluator()
+        if cache is not self.__source_cache or len(self.__anchors) > self.max_anchors:
+            self.__tiles.clear()
+            self.__anchors = {}
+            self.__source_cache = cache
+
+        with profiler.graph(self.label):
+            with profiler.stage("evaluate"):
+                level, tile_width = SampleCache.level(arg_scale)
+                first = math.floor(arg_lim.min / tile_width)
+                last = math.floor(arg_lim.max / tile_width)
+                offset = self.__offset(func, level, first, tile_width)
+                tiles = []
+                for index in range(first, last + 1):
+                    tile_args, tile_integral, total = self.__tile(func, level, index, tile_width)
+                    tiles.append((tile_args, tile_integral, offset))
+                    offset += total
+                    self.__anchors[(level, index + 1)] = offset
+
+            with profiler.stage("integrate"):
+                # neighbouring tiles share their edge sample
+                size = len(tiles) * self.tile_intervals + 1
+                args, vals = self.buffers.get("args", size), self.buffers.get("integral", size)
+                for i, (tile_args, tile_integral, offset) in enumerate(tiles):
+                    pos = i * self.tile_intervals
+                    args[pos:pos + self.tile_intervals + 1] = tile_args
+                    np.add(tile_integral, offset, out=vals[pos:pos + self.tile_intervals + 1])
+                lo = max(int(np.searchsorted(args, arg_lim.min, "right")) - 1, 0)
+                hi = int(np.searchsorted(args, arg_lim.max, "left")) + 1
+                args, vals = args[lo:hi], vals[lo:hi]
+
+            with profiler.stage("mask"):
+                val_lim.clip_inplace(vals, self.buffers.get("mask", len(vals), bool))
+                args, vals = break_discontinuities(args, vals, val_lim.span(), self.buffers)
+            with profiler.stage("decimate"):
+                args, vals = decimate(args, vals, arg_lim.min, arg_lim.max, (arg_lim.max - arg_lim.min) * arg_scale)
+        return (args, vals) if arg_axis == 0 else (vals, args)
+
+    def __tile(self, func: Callable, level: int, index: int, tile_width: float) -> tuple[np.ndarray, np.ndarray, float]:
+        # the running integral over one tile from its left edge, nan where the integrand is not finite
+        key = (level, index)
+        tile = self.__tiles.get(key)
+        if tile is not None:
+            self.__tiles.move_to_end(key)
+            return tile
+
+        n = self.tile_intervals
+        args = coarse_grid(index * tile_width, (index + 1) * tile_width, n + 1)
+        vals = func(args)
+        f = np.where(np.isfinite(vals), vals, 0.0)
+        h = tile_width / n
+        f0, f1, f2 = f[0:-2:2], f[1::2], f[2::2]
+        integral = np.empty(n + 1)
+        integral[0] = 0.0
+        # composite simpson at the even nodes and its third order half step at the odd ones
+        np.cumsum(h / 3 * (f0 + 4 * f1 + f2), out=integral[2::2])
+        integral[1::2] = integral[0:-2:2] + h / 12 * (5 * f0 + 8 * f1 - f2)
+        total = float(integral[-1])
+        integral[~np.isfinite(vals)] = np.nan
+
+        tile = self.__tiles[key] = (args, integral, total)
+        if len(self.__tiles) > self.max_tiles:
+            self.__tiles.popitem(last=False)
+        return tile
+
+    def __offset(self, func: Callable, level: int, first: int, tile_width: float) -> float:
+        offset = self.__anchors.get((level, first))
+        if offset is not None:
+            return offset
+        # edge 0 is the lower limit on every level, otherwise the closest known edge of the same level
+        base = min([index for lvl, index in self.__anchors if lvl == level] + [0], key=lambda index: abs(index - first))
+        offset = self.__anchors.get((level, base), 0.0)
+        if abs(first - base) <= self.max_walk_tiles:
+            step = 1 if first > base else -1
+            for index in range(base, first, step):
+                _, _, total = self.__tile(func, level, index if step > 0 else index - 1, tile_width)
+                offset += step * total
+                self.__anchors[(level, index + step)] = offset
+            return offset
+
+        # a far jump is bridged in one pass of composite simpson instead of tile by tile
+        num_points = int(np.clip(abs(first - base) * self.tile_intervals, 64, self.max_offset_points)) | 1
+        args = np.linspace(base * tile_width, first * tile_width, num_points)
+        vals = func(args)
+        f = np.where(np.isfinite(vals), vals, 0.0)
+        h = (first - base) * tile_width / (num_points - 1)
+        offset += h / 3 * (f[0] + f[-1] + 4 * f[1:-1:2].sum() + 2 * f[2:-1:2].sum())
+        self.__anchors[(level, first)] = offset
+        return offset
+
+
+class LodPyramid:
+    def __init__(self, x: np.ndarray, y: np.ndarray):
+        self.x = x
+        self.y = y
+        # level k holds the indices of the min and max y of every bucket of 2 ** k points
+        self.levels: list[tuple[np.ndarray, np.ndarray]] = []
+        idx_min = idx_max = np.arange(len(y))
+        while len(idx_min) > 1:
+            if len(idx_min) % 2:
+                idx_min = np.append(idx_min, idx_min[-1])
+                idx_max = np.append(idx_max, idx_max[-1])
+            a, b = idx_min[0::2], idx_min[1::2]
+            idx_min = np.where((y[a] <= y[b]) | np.isnan(y[b]), a, b)
+            a, b = idx_max[0::2], idx_max[1::2]
+            idx_max = np.where((y[a] >= y[b]) | np.isnan(y[b]), a, b)
+            self.levels.append((idx_min, idx_max))
+
+    def query(self, x_min: float, x_max: float, pixels: float) -> tuple[np.ndarray, np.ndarray]:
+        start = max(int(np.searchsorted(self.x, x_min, "left")) - 1, 0)
+        stop = min(int(np.searchsorted(self.x, x_max, "right")) + 1, len(self.x))
+        level = min(int(np.log2(max((stop - start) / max(pixels, 1), 1))), len(self.levels))
+        if level == 0:
+            return self.x[start:stop], self.y[start:stop]
+
+        # at least one bucket per pixel column, each sending its min and max in x order
+        idx_min, idx_max = self.levels[level - 1]
+        first, last = start >> level, ((stop - 1) >> level) + 1
+        lo, hi = idx_min[first:last], idx_max[first:last]
+        idx = np.empty(2 * len(lo), dtype=np.intp)
+        idx[0::2] = np.minimum(lo, hi)
+        idx[1::2] = np.maximum(lo, hi)
+        return self.x[idx], self.y[idx]
+
+
+class GraphImplicit(FuncGraph):
+    def __init__(self, func: Callable = None, lim_x: DynamicRange = None, lim_y: DynamicRange = None):
+        super().__init__(GraphType.IMPLICIT, func, lim_x, lim_y)
+
+    @property
+    def label(self) -> str:
+        return equation_label(self.text)
+
+    def _sample(self, viewport: tuple[DynamicRange, DynamicRange, float, float]):
+        lim_x, lim_y, scale_x, scale_y = viewport
+        func, have_arg = self._bound_func(), self._have_arg
+        with profiler.graph(self.label):
+            with profiler.stage("evaluate"):
+                cells = implicit_cells(func, have_arg, lim_x.min, lim_x.max, lim_y.min, lim_y.max, scale_x, scale_y)
+            with profiler.stage("contour"):
+                return marching_squares(func, have_arg, *cells)
+
+    def process_text(self, text: str):
+        lhs, _, rhs = text.partition("=")
+        expr = f"({lhs}) - ({rhs})" if rhs.strip() else lhs
+        with profiler.graph(equation_label(text)):
+            self.func = expression_cache.compile(expr, "x y", backend=self.backend)
+        self.text = text
+
+
+def equation_label(text: str | None) -> str:
+    # an expression alone is read as expression = 0, an equation is shown as typed
+    return text if text is not None and "=" in text else f"{text} = 0"
+
+
+def evaluate_2d(func: Callable, have_arg: bool, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    shape = np.broadcast_shapes(np.shape(x), np.shape(y))
+    if not have_arg:
+        return np.full(shape, func(), dtype=float)
+    with np.errstate(all="ignore"):
+        return np.broadcast_to(np.asarray(func(x, y), dtype=float), shape)
+
+
+def implicit_cells(func: Callable, have_arg: bool, x_min: float, x_max: float, y_min: float, y_max: float,
+                   scale_x: float, scale_y: float, coarse_step=8.0, min_step=1.0, max_cells=200_000):
+    nx = max(int((x_max - x_min) * scale_x / coarse_step), 2)
+    ny = max(int((y_max - y_min) * scale_y / coarse_step), 2)
+    xs = np.linspace(x_min, x_max, nx + 1)
+    ys = np.linspace(y_min, y_max, ny + 1)
+    grid = evaluate_2d(func, have_arg, xs[None, :], ys[:, None])
+
+    # corners are ordered (x0, y0), (x1, y0), (x0, y1), (x1, y1)
+    corners = np.stack((grid[:-1, :-1], grid[:-1, 1:], grid[1:, :-1], grid[1:, 1:]), axis=-1).reshape(-1, 4)
+    cell_x = np.broadcast_to(xs[None, :-1], (ny, nx)).ravel()
+    cell_y = np.broadcast_to(ys[:-1, None], (ny, nx)).ravel()
+    width, height = xs[1] - xs[0], ys[1] - ys[0]
+
+    crossing = _crossing(corners)
+    cell_x, cell_y, corners = cell_x[crossing], cell_y[crossing], corners[crossing]
+
+    # quadtree: only cells the curve passes through are split, so the cost follows the curve length
+    while (width * scale_x > min_step or height * scale_y > min_step) and 0 < 4 * len(corners) <= max_cells:
+        half_w, half_h = width / 2, height / 2
+        px = np.concatenate((cell_x + half_w, cell_x, cell_x + half_w, cell_x + width, cell_x + half_w))
+        py = np.concatenate((cell_y, cell_y + half_h, cell_y + half_h, cell_y + half_h, cell_y + height))
+        bottom, left, center, right, top = evaluate_2d(func, have_arg, px, py).reshape(5, -1)
+        c00, c10, c01, c11 = corners.T
+
+        corners = np.concatenate((
+            np.stack((c00, bottom, left, center), axis=1),
+            np.stack((bottom, c10, center, right), axis=1),
+            np.stack((left, center, c01, top), axis=1),
+            np.stack((center, right, top, c11), axis=1),
+        ))
+        cell_x = np.concatenate((cell_x, cell_x + half_w, cell_x, cell_x + half_w))
+        cell_y = np.concatenate((cell_y, cell_y, cell_y + half_h, cell_y + half_h))
+        width, height = half_w, half_h
+
+        crossing = _crossing(corners)
+        cell_x, cell_y, corners = cell_x[crossing], cell_y[crossing], corners[crossing]
+
+    return cell_x, cell_y, width, height, corners
+
+
+def _crossing(corners: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore"):
+        return (corners.min(axis=1) <= 0) & (corners.max(axis=1) >= 0)
+
+
+def marching_squares(func: Callable, have_arg: bool, cell_x: np.ndarray, cell_y: np.ndarray, width: float,
+                     height: float, corners: np.ndarray):
+    if len(corners) == 0:
+        return np.empty(0), np.empty(0)
+
+    c00, c10, c01, c11 = corners.T
+    inside = corners > 0
+    # edges: bottom (c00-c10), right (c10-c11), top (c01-c11), left (c00-c01)
+    starts = np.stack((c00, c10, c01, c00), axis=1)
+    ends = np.stack((c10, c11, c11, c01), axis=1)
+    cut = inside[:, [0, 1, 2, 0]] != inside[:, [1, 3, 3, 2]]
+    with np.errstate(all="ignore"):
+        t = np.clip(starts / (starts - ends), 0, 1)
+    t = np.where(np.isfinite(t), t, 0.5)
+
+    ex = cell_x[:, None] + np.stack((t[:, 0] * width, np.full(len(t), width), t[:, 2] * width,
+                                     np.zeros(len(t))), axis=1)
+    ey = cell_y[:, None] + np.stack((np.zeros(len(t)), t[:, 1] * height, np.full(len(t), height),
+                                     t[:, 3] * height), axis=1)
+
+    count = cut.sum(axis=1)
+    two = np.flatnonzero(count == 2)
+    edges = np.nonzero(cut[two])[1].reshape(-1, 2)
+    seg_cells = [two, two]
+    seg_edges = [edges[:, 0], edges[:, 1]]
+
+    # saddles are split by the sign of the cell centre
+    four = np.flatnonzero(count == 4)
+    joined = (corners[four].mean(axis=1) > 0) == inside[four, 0]
+    first = np.where(joined, 0, 0), np.where(joined, 1, 3)
+    second = np.where(joined, 3, 1), np.where(joined, 2, 2)
+    seg_cells += [np.concatenate((four, four)), np.concatenate((four, four))]
+    seg_edges += [np.concatenate((first[0], second[0])), np.concatenate((first[1], second[1]))]
+
+    cells_a, cells_b = np.concatenate(seg_cells[0::2]), np.concatenate(seg_cells[1::2])
+    edges_a, edges_b = np.concatenate(seg_edges[0::2]), np.concatenate(seg_edges[1::2])
+    x0, y0 = ex[cells_a, edges_a], ey[cells_a, edges_a]
+    x1, y1 = ex[cells_b, edges_b], ey[cells_b, edges_b]
+
+    # a sign change across a pole is not a zero: at the crossing point F is even larger than the corner of
+    # the same sign, while at a zero it is well below it; cells with an infinite corner sit on a pole
+    keep = np.isfinite(corners[cells_a]).all(axis=1)
+    keep &= _is_zero(func, have_arg, x0, y0, starts[cells_a, edges_a], ends[cells_a, edges_a])
+    keep &= _is_zero(func, have_arg, x1, y1, starts[cells_b, edges_b], ends[cells_b, edges_b])
+    x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+
+    nan = np.full(len(x0), np.nan)
+    return np.column_stack((x0, x1, nan)).ravel(), np.column_stack((y0, y1, nan)).ravel()
+
+
+def _is_zero(func: Callable, have_arg: bool, x: np.ndarray, y: np.ndarray, start: np.ndarray,
+             end: np.ndarray) -> np.ndarray:
+    vals = evaluate_2d(func, have_arg, x, y)
+    with np.errstate(invalid="ignore"):
+        same = np.where((vals > 0) == (start > 0), np.abs(start), np.abs(end))
+        return np.abs(vals) <= 0.5 * same
 
 
 class GraphPoints(AbstractGraph):
+    lod_min_points = 20_000
 
-    def __init__(self, points: list[tuple[float, float]]):
+    def __init__(self, points: list[tuple[float, float]] | np.ndarray, capacity: int | None = None):
         super().__init__(GraphType.POINTS)
-        self.__x_points = []
-        self.__y_points = []
+        self.__x_points = np.empty(16)
+        self.__y_points = np.empty(16)
+        self.__start = 0
+        self.__size = 0
+        self.capacity = None
+        self.set_capacity(capacity)
+        self.__pyramid: tuple[int, LodPyramid | None] | None = None
         self.set_points(points)
 
-    def set_points(self, points: list[tuple[float, float]]):
-        self.__x_points.clear()
-        self.__y_points.clear()
-        for x, y in points:
-            self.add_point(x, y)
+    def state(self) -> tuple:
+        ax = self.line.axes
+        if ax is None or len(self) < self.lod_min_points:
+            return (self.version,)
+        return (self.version, tuple(ax.get_xlim()), ax.get_window_extent().width)
+
+    @property
+    def x_points(self) -> np.ndarray:
+        return self.__x_points[self.__start:self.__size]
+
+    @property
+    def y_points(self) -> np.ndarray:
+        return self.__y_points[self.__start:self.__size]
+
+    def __len__(self):
+        return self.__size - self.__start
+
+    def set_capacity(self, capacity: int | None):
+        # with a capacity only the newest points are kept, in a buffer twice that size so the window
+        # stays contiguous and is moved to the front once per capacity points
+        x_points, y_points = self.x_points, self.y_points
+        if capacity is not None:
+            x_points, y_points = x_points[-capacity:], y_points[-capacity:]
+            self.__x_points, self.__y_points = np.empty(2 * capacity), np.empty(2 * capacity)
+        self.capacity = capacity
+        self.__start = self.__size = 0
+        self.extend(x_points.copy(), y_points.copy())
+
+    def set_points(self, points: list[tuple[float, float]] | np.ndarray):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.__start = self.__size = 0
+        self.extend(points[:, 0], points[:, 1])
+
+    def extend(self, x: np.ndarray, y: np.ndarray):
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        if len(x) != len(y):
+            raise ValueError("x and y must have the same length")
+
+        if self.capacity is not None:
+            x, y = x[-self.capacity:], y[-self.capacity:]
+            if self.__size + len(x) > len(self.__x_points):
+                keep = min(len(self), self.capacity - len(x))
+                self.__x_points[:keep] = self.__x_points[self.__size - keep:self.__size]
+                self.__y_points[:keep] = self.__y_points[self.__size - keep:self.__size]
+                self.__start, self.__size = 0, keep
+        else:
+            self.__reserve(self.__size + len(x))
+
+        size = self.__size + len(x)
+        self.__x_points[self.__size:size] = x
+        self.__y_points[self.__size:size] = y
+        self.__size = size
+        if self.capacity is not None:
+            self.__start = max(self.__start, size - self.capacity)
+        self.version += 1
 
     def add_point(self, x, y):
-        self.__x_points.append(x)
-        self.__y_points.append(y)
+        self.extend(np.array([x]), np.array([y]))
+
+    def load(self, path: str):
+        self.set_points(load_points(path))
+
+    def __reserve(self, size: int):
+        capacity = len(self.__x_points)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        x_points, y_points = np.empty(capacity), np.empty(capacity)
+        x_points[:self.__size] = self.__x_points[:self.__size]
+        y_points[:self.__size] = self.__y_points[:self.__size]
+        self.__x_points, self.__y_points = x_points, y_points
 
     def draw(self):
-        self.line.set_data(self.__x_points, self.__y_points)
+        x_points, y_points = self.x_points, self.y_points
+        ax = self.line.axes
+        if ax is not None and len(self) >= self.lod_min_points:
+            with profiler.stage("decimate", self.graph_type.value):
+                pyramid = self.__lod()
+                if pyramid is not None:
+                    x_points, y_points = pyramid.query(*ax.get_xlim(), ax.get_window_extent().width)
+        with profiler.stage("set_data", self.graph_type.value):
+            self.line.set_data(x_points, y_points)
+
+    def __lod(self) -> LodPyramid | None:
+        if self.__pyramid is None or self.__pyramid[0] != self.version:
+            x_points = self.x_points
+            # min/max buckets only keep the shape of lines whose points go left to right
+            monotonic = bool(np.all(x_points[1:] >= x_points[:-1]))
+            self.__pyramid = (self.version, LodPyramid(x_points.copy(), self.y_points.copy()) if monotonic else None)
+        return self.__pyramid[1]
 
     def process_text(self, text: str):
-        points = []
-        for gr in re.finditer(r"(\(-?[0-9]+;-?[0-9]+\))", text.replace(" ", "")):
-            g = gr.group()
-            x = int(g[g.index("(") + 1:g.index(";")])
-            y = int(g[g.index(";") + 1:g.index(")")])
-            points.append((x, y))
-        self.set_points(points)
+        self.set_points(parse_points(text))
+
+
+_number = r"\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*"
+_point_re = re.compile(rf"\({_number};{_number}\)")
+
+
+def parse_points(text: str) -> np.ndarray:
+    pairs = _point_re.findall(text)
+    if not pairs:
+        return np.empty((0, 2))
+    return np.array(pairs, dtype=np.float64)
+
+
+def load_points(path: str) -> np.ndarray:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        points = np.load(path, mmap_mode="r")
+        if points.ndim == 2 and points.shape[0] == 2 and points.shape[1] != 2:
+            # np.vstack([x, y]) stores the coordinates as rows
+            points = points.T
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError(f"expected an (n, 2) or (2, n) array of points, got {points.shape}")
+    elif ext in (".bin", ".raw", ".f64"):
+        # raw files hold interleaved little-endian float64 pairs x0, y0, x1, y1, ...
+        points = np.memmap(path, dtype="<f8", mode="r")
+        if len(points) % 2:
+            raise ValueError(f"odd number of values in {path}, expected x, y pairs")
+    else:
+        with open(path, encoding="utf-8") as f:
+            first = f.readline()
+        delimiter = next((d for d in (";", ",", "\t") if d in first), None)
+        try:
+            [float(v) for v in first.split(delimiter)[:2]]
+            skip = 0
+        except ValueError:
+            skip = 1
+        points = np.loadtxt(path, delimiter=delimiter, skiprows=skip, usecols=(0, 1), dtype=np.float64, ndmin=2)
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def create_graph(graph_type: GraphType) -> AbstractGraph:
+    match graph_type:
+        case GraphType.X:
+            return GraphX()
+        case GraphType.Y:
+            return GraphY()
+        case GraphType.POINTS:
+            return GraphPoints([])
+        case GraphType.IMPLICIT:
+            return GraphImplicit()
+        case GraphType.DERIVATIVE:
+            return GraphDerivative()
+        case GraphType.INTEGRAL:
+            return GraphIntegral()
 
 
 def delete_graph(graph: AbstractGraph, ax: Axes):
     if graph.line is not None and graph.line in ax.get_lines():
         graph.line.remove()
+    if isinstance(graph, FuncGraph) and graph.collection is not None and graph.collection in ax.collections:
+        graph.collection.remove()
+
+
+def add_artists(graph: AbstractGraph, ax: Axes):
+    if graph.line not in ax.get_lines():
+        ax.add_line(graph.line)
+    if isinstance(graph, FuncGraph) and graph.collection is not None and graph.collection not in ax.collections:
+        ax.add_collection(graph.collection, autolim=False)
+
+
+def update_view(graph: LimGraph, ax: Axes, quality=1.0):
+    x_min, x_max = ax.get_xlim()
+    y_min, y_max = ax.get_ylim()
+    graph.update_lim_x(x_min, x_max)
+    graph.update_lim_y(y_min, y_max)
+
+    # below full quality graphs are sampled as if the axes had fewer pixels
+    bbox = ax.get_window_extent()
+    graph.update_scale(bbox.width * quality / abs(x_max - x_min), bbox.height * quality / abs(y_max - y_min))
 
 
 def plot(text_func: str, graph: AbstractGraph, ax: Axes):
     if isinstance(graph, LimGraph):
-        x_min, x_max = ax.get_xlim()
-        y_min, y_max = ax.get_ylim()
-        graph.update_lim_x(x_min, x_max)
-        graph.update_lim_y(y_min, y_max)
+        update_view(graph, ax)
 
     graph.process_text(text_func)
     graph.draw()
+    add_artists(graph, ax)
 
-    if graph.line not in ax.get_lines():
-        ax.add_line(graph.line)
 
+@lru_cache(maxsize=1024)
+def coarse_grid(arg_min: float, arg_max: float, num_points: int) -> np.ndarray:
+    # graphs over the same domain and zoom get the same tiles, so they share one read-only grid per tile
+    grid = np.linspace(arg_min, arg_max, num_points)
+    grid.flags.writeable = False
+    return grid
+
+
+def adaptive_sample(func: Callable, arg_min: float, arg_max: float, arg_scale: float, val_scale: float,
+                    val_lim: DynamicRange, tolerance=0.5, coarse_step=4.0, min_step=0.05, max_points=30_000,
+                    max_depth=12):
+    # arg_scale/val_scale are pixels per data unit; tolerance, coarse_step and min_step are in pixels
+    num_points = int(np.clip(abs(arg_max - arg_min) * arg_scale / coarse_step, 64, max_points // 4)) + 1
+    args = coarse_grid(float(arg_min), float(arg_max), num_points)
+    vals = func(args)
+
+    # values far outside the visible range are clamped so that they do not look like errors
+    margin = val_lim.span() or 0
+    clamp_min = val_lim.min - margin if val_lim.min is not None else -np.inf
+    clamp_max = val_lim.max + margin if val_lim.max is not None else np.inf
+
+    active = np.ones(len(args) - 1, dtype=bool)
+    for _ in range(max_depth):
+        active &= np.diff(args) * arg_scale > min_step
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+
+        mids = (args[idx] + args[idx + 1]) / 2
+        mid_vals = func(mids)
+
+        with np.errstate(invalid="ignore"):
+            v0 = np.clip(vals[idx], clamp_min, clamp_max)
+            v1 = np.clip(vals[idx + 1], clamp_min, clamp_max)
+            vm = np.clip(mid_vals, clamp_min, clamp_max)
+            error = np.abs(vm - (v0 + v1) / 2) * val_scale
+            finite = np.isfinite(v0).astype(int) + np.isfinite(v1) + np.isfinite(vm)
+            # a partially finite interval holds a domain edge or a pole and is refined as well
+            error = np.where(finite == 3, error, np.where(finite == 0, 0, np.inf))
+            refine = error > tolerance
+
+        budget = max_points - len(args)
+        if np.count_nonzero(refine) > budget:
+            refine[:] = False
+            if budget > 0:
+                refine[np.argsort(error)[-budget:]] = True
+
+        active[:] = False
+        if not refine.any():
+            break
+        split = idx[refine]
+        shift = np.arange(len(split))
+        args = np.insert(args, split + 1, mids[refine])
+        vals = np.insert(vals, split + 1, mid_vals[refine])
+
+        active = np.zeros(len(args) - 1, dtype=bool)
+        active[split + shift] = True
+        active[split + shift + 1] = True
+
+    return args, vals
+
+
+def decimate(args: np.ndarray, vals: np.ndarray, arg_min: float, arg_max: float, pixels: float):
+    if len(args) <= 4 * pixels or pixels <= 0:
+        return args, vals
+
+    # M4: the first, last, min and max sample of every pixel column draw the same pixels as all of them
+    with np.errstate(invalid="ignore"):
+        columns = np.floor((args - arg_min) * (pixels / (arg_max - arg_min)))
+        columns[np.isnan(args)] = np.nan
+    n = len(vals)
+    starts = np.flatnonzero(np.concatenate(([True], columns[1:] != columns[:-1])))
+    ends = np.concatenate((starts[1:], [n])) - 1
+
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.concatenate((starts, [n]))))
+    index = np.arange(n)
+    seg_min = np.fmin.reduceat(vals, starts)
+    seg_max = np.fmax.reduceat(vals, starts)
+    arg_mins = np.minimum.reduceat(np.where(vals == seg_min[segment], index, n - 1), starts)
+    arg_maxs = np.minimum.reduceat(np.where(vals == seg_max[segment], index, n - 1), starts)
+
+    # one NaN per run is enough to keep the breaks between branches
+    nans = np.isnan(vals) | np.isnan(args)
+    nan_starts = np.flatnonzero(nans & ~np.concatenate(([False], nans[:-1])))
+
+    keep = np.unique(np.concatenate((starts, ends, arg_mins, arg_maxs, nan_starts)))
+    return args[keep], vals[keep]
+
+
+def break_rows(vals: np.ndarray, span: float | None, jump_ratio=4) -> np.ndarray:
+    # break_discontinuities for a family of curves: a jump blanks the sample after it instead of adding one
+    with np.errstate(invalid="ignore"):
+        if span is None:
+            span = np.fmax.reduce(vals, axis=None) - np.fmin.reduce(vals, axis=None)
+        diff = np.diff(vals, axis=-1)
+        pad = np.full(diff.shape[:-1] + (1,), np.nan)
+        prev_diff = np.concatenate((pad, diff[..., :-1]), axis=-1)
+        next_diff = np.concatenate((diff[..., 1:], pad), axis=-1)
+        against_slope = (np.sign(diff) != np.sign(prev_diff)) & (np.sign(diff) != np.sign(next_diff))
+        steeper = np.abs(diff) > jump_ratio * np.fmax(np.abs(prev_diff), np.abs(next_diff))
+        breaks = (np.abs(diff) > span / 50) & (against_slope | steeper)
+    vals[..., 1:][breaks] = np.nan
+    return vals
+
+
+def break_discontinuities(args: np.ndarray, vals: np.ndarray, span: float | None, buffers: SampleBuffers = None,
+                          jump_ratio=4):
+    n = len(vals)
+    if n < 3:
+        return args, vals
+    buffers = SampleBuffers() if buffers is None else buffers
+
+    with np.errstate(invalid="ignore"):
+        if span is None:
+            span = np.fmax.reduce(vals) - np.fmin.reduce(vals)
+            if not np.isfinite(span):
+                return args, vals
+        threshold = span / 50
+
+        # differences padded with nan, so the first and last ones have a missing neighbour like before
+        sign = buffers.get("sign", n + 1)
+        abs_diff = buffers.get("abs_diff", n + 1)
+        sign[0] = sign[-1] = abs_diff[0] = abs_diff[-1] = np.nan
+        np.subtract(vals[1:], vals[:-1], out=abs_diff[1:-1])
+        np.sign(abs_diff[1:-1], out=sign[1:-1])
+        np.abs(abs_diff[1:-1], out=abs_diff[1:-1])
+        # slopes rather than differences, the adaptive sampler spaces the samples unevenly
+        slope = buffers.get("slope", n + 1)
+        slope[0] = slope[-1] = np.nan
+        np.subtract(args[1:], args[:-1], out=slope[1:-1])
+        np.abs(slope[1:-1], out=slope[1:-1])
+        np.divide(abs_diff[1:-1], slope[1:-1], out=slope[1:-1])
+        flags = buffers.get("flags", n - 1, bool)
+        other = buffers.get("other", n - 1, bool)
+        steep = buffers.get("steep", n - 1)
 
-def calculate_num_points(val_min, val_max, base_range=20):
-    min_points = 5000
-    max_points = 30_000
-    eps = 1e-6
-    current_range = max(abs(val_max - val_min), eps)
+        # a jump goes against the slope on both sides (tan, 1/x) or is much steeper than it (floor)
+        np.not_equal(sign[1:-1], sign[:-2], out=flags)
+        np.not_equal(sign[1:-1], sign[2:], out=other)
+        np.logical_and(flags, other, out=flags)
+        np.fmax(slope[:-2], slope[2:], out=steep)
+        np.multiply(steep, jump_ratio, out=steep)
+        np.greater(slope[1:-1], steep, out=other)
+        np.logical_or(flags, other, out=flags)
+        np.greater(abs_diff[1:-1], threshold, out=other)
+        np.logical_and(flags, other, out=flags)
 
-    sigmoid_factor = 1 / (1 + np.exp(0.1 * (current_range - base_range)))
+        # a sample right on the jump (sign at 0) splits it into two steps, so the pair is tested as one
+        pair = buffers.get("pair", n - 2, bool)
+        pair_other = buffers.get("pair_other", n - 2, bool)
+        pair_diff = buffers.get("pair_diff", n - 2)
+        pair_slope = buffers.get("pair_slope", n - 2)
+        np.equal(sign[1:-2], sign[2:-1], out=pair)
+        np.subtract(vals[2:], vals[:-2], out=pair_diff)
+        np.abs(pair_diff, out=pair_diff)
+        np.greater(pair_diff, threshold, out=pair_other)
+        np.logical_and(pair, pair_other, out=pair)
+        np.subtract(args[2:], args[:-2], out=pair_slope)
+        np.abs(pair_slope, out=pair_slope)
+        np.divide(pair_diff, pair_slope, out=pair_slope)
+        np.fmax(slope[:-3], slope[3:], out=pair_diff)
+        np.multiply(pair_diff, jump_ratio, out=pair_diff)
+        np.greater(pair_slope, pair_diff, out=pair_other)
+        np.logical_and(pair, pair_other, out=pair)
+        np.logical_or(flags[:-1], pair, out=flags[:-1])
+        np.logical_or(flags[1:], pair, out=flags[1:])
+        breaks = np.flatnonzero(flags) + 1
 
-    num_points = int((max_points - min_points) * sigmoid_factor + min_points)
+    if len(breaks) == 0:
+        return args, vals
 
-    return num_points
+    out_args = buffers.get("break_args", n + len(breaks))
+    out_vals = buffers.get("break_vals", n + len(breaks))
+    start = 0
+    for shift, stop in enumerate(breaks):
+        out_args[start + shift:stop + shift] = args[start:stop]
+        out_vals[start + shift:stop + shift] = vals[start:stop]
+        out_args[stop + shift] = out_vals[stop + shift] = np.nan
+        start = stop
+    out_args[start + len(breaks):] = args[start:]
+    out_vals[start + len(breaks):] = vals[start:]
+    return out_args, out_vals
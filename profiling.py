@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+_NULL = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "graph", "start")
+
+    def __init__(self, profiler: "Profiler", name: str, graph: str | None):
+        self.profiler = profiler
+        self.name = name
+        self.graph = graph
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter(), self.graph)
+
+
+class _GraphScope:
+    __slots__ = ("local", "label", "previous")
+
+    def __init__(self, local: threading.local, label: str):
+        self.local = local
+        self.label = label
+
+    def __enter__(self):
+        self.previous = getattr(self.local, "graph", None)
+        self.local.graph = self.label
+        return self
+
+    def __exit__(self, *exc):
+        self.local.graph = self.previous
+
+
+class Profiler:
+    def __init__(self, enabled=False, max_events=100_000):
+        self.enabled = enabled
+        self.events: deque[tuple[str, float, float, str | None, int]] = deque(maxlen=max_events)
+        self.graph_times: dict[str, dict[str, float]] = {}
+        self.counters: dict[str, float] = {}
+        self.counter_events: deque[tuple[str, float, float]] = deque(maxlen=max_events)
+        self.frame_time = 0.0
+        self.__local = threading.local()
+        self.__origin = time.perf_counter()
+
+    def stage(self, name: str, graph: str | None = None):
+        # the disabled path hands out one shared no-op context, so hooks stay in place at no cost
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name, graph)
+
+    def graph(self, label: str):
+        if not self.enabled:
+            return _NULL
+        return _GraphScope(self.__local, label)
+
+    def frame(self):
+        return self.stage("frame")
+
+    def record(self, name: str, start: float, end: float, graph: str | None = None):
+        if graph is None:
+            graph = getattr(self.__local, "graph", None)
+        self.events.append((name, start, end, graph, threading.get_ident()))
+        if name == "frame":
+            self.frame_time = end - start
+        elif graph is not None:
+            self.graph_times.setdefault(graph, {})[name] = end - start
+
+    def counter(self, name: str, value: float):
+        if not self.enabled:
+            return
+        self.counters[name] = value
+        self.counter_events.append((name, time.perf_counter(), value))
+
+    def slowest_graph(self) -> tuple[str, float] | None:
+        if not self.graph_times:
+            return None
+        return max(((graph, sum(times.values())) for graph, times in self.graph_times.items()),
+                   key=lambda item: item[1])
+
+    def reset(self):
+        self.events.clear()
+        self.graph_times.clear()
+        self.counters.clear()
+        self.counter_events.clear()
+        self.frame_time = 0.0
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = []
+        for name, start, end, graph, tid in list(self.events):
+            event = {
+                "name": name,
+                "cat": "frame" if name == "frame" else "graph" if graph is not None else "canvas",
+                "ph": "X",
+                "ts": (start - self.__origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            if graph is not None:
+                event["args"] = {"graph": graph}
+            events.append(event)
+        for name, moment, value in list(self.counter_events):
+            events.append({"name": name, "ph": "C", "ts": (moment - self.__origin) * 1e6, "pid": pid,
+                           "args": {name: value}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+profiler = Profiler(enabled=os.environ.get("ELMOS_PROFILE") == "1")
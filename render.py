@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import mat
+
+
+def load_batch(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        batch = json.load(f)
+    if isinstance(batch, list):
+        return batch
+
+    defaults = batch.get("defaults", {})
+    return [{**defaults, **spec} for spec in batch["plots"]]
+
+
+def render_plot(spec: dict, out_dir: str = ".") -> dict:
+    start = time.perf_counter()
+    width, height = spec.get("size", (1200, 800))
+    dpi = spec.get("dpi", 100)
+
+    figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    ax.set_xlim(*spec.get("xlim", (-10, 10)))
+    ax.set_ylim(*spec.get("ylim", (-10, 10)))
+    ax.grid(True)
+
+    errors = []
+    for graph_spec in spec["graphs"]:
+        graph = mat.create_graph(mat.GraphType(graph_spec.get("type", "y")))
+        try:
+            mat.plot(graph_spec["text"], graph, ax)
+        except Exception as e:
+            errors.append(f"{graph_spec['text']}: {e}")
+            continue
+        if isinstance(graph, mat.FuncGraph) and graph.func is None:
+            errors.append(f"{graph_spec['text']}: wrong function")
+        if "color" in graph_spec:
+            graph.line.set_color(graph_spec["color"])
+        if "label" in graph_spec:
+            graph.line.set_label(graph_spec["label"])
+    if len(ax.get_legend_handles_labels()[0]) != 0:
+        ax.legend()
+    plotted = time.perf_counter()
+
+    output = os.path.join(out_dir, spec["output"])
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    figure.savefig(output)
+    saved = time.perf_counter()
+
+    return {
+        "output": output,
+        "plot_time": plotted - start,
+        "save_time": saved - plotted,
+        "total_time": saved - start,
+        "compile_hits": mat.expression_cache.hits,
+        "compile_misses": mat.expression_cache.misses,
+        "errors": errors,
+    }
+
+
+def render_batch(specs: list[dict], out_dir: str = ".", workers: int | None = None) -> list[dict]:
+    if workers == 1:
+        return [render_plot(spec, out_dir) for spec in specs]
+
+    # every worker keeps its own expression cache, so repeated expressions are compiled once per process
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(render_plot, specs, [out_dir] * len(specs)))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Render Elmos plots without a window")
+    parser.add_argument("batch", help="JSON file with a list of plots or {'defaults': ..., 'plots': [...]}")
+    parser.add_argument("-o", "--out-dir", default=".", help="directory for the rendered files")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--report", help="write per-plot timings to this JSON file")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = render_batch(load_batch(args.batch), args.out_dir, args.workers)
+    total = time.perf_counter() - start
+
+    for result in results:
+        print(f"{result['output']}: {result['total_time'] * 1000:.1f} ms "
+              f"(plot {result['plot_time'] * 1000:.1f} ms, save {result['save_time'] * 1000:.1f} ms)")
+        for error in result["errors"]:
+            print(f"  error: {error}", file=sys.stderr)
+    print(f"{len(results)} plots in {total:.2f} s")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"total_time": total, "plots": results}, f, indent=2)
+
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import inspect
+import math
+import multiprocessing
+import os
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class ExpressionLimitError(Exception):
+    pass
+
+
+class Sandbox:
+    startup_timeout = 60.0
+
+    def __init__(self, time_limit=3.0, memory_limit=2 * 1024 ** 3):
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.timeouts = 0
+        self.__context = multiprocessing.get_context("spawn")
+        self.__pid = os.getpid()
+        self.__lock = threading.Lock()
+        self.__process = None
+        self.__conn = None
+        self.__ready = False
+        self.__start()
+
+    def check(self, text: str, var: str, mods: list, backend: str, cache_dir: str | None):
+        # worker processes of the evaluator inherit the expression cache, but not this pipe
+        if os.getpid() != self.__pid:
+            return
+        self.__call("check", text, var, mods, backend, cache_dir)
+
+    def derivative(self, text: str, var: str) -> str:
+        # sympy can take unbounded time on a derivative as well, so it is taken within the same budget
+        return self.__call("derivative", text, var)
+
+    def shutdown(self):
+        with self.__lock:
+            self.__stop()
+
+    def __call(self, kind: str, *args):
+        with self.__lock:
+            if not self.__wait_ready():
+                self.__restart()
+                raise ExpressionLimitError("Не удалось запустить проверку выражения")
+
+            self.__conn.send((kind, args, self.time_limit))
+            if not self.__conn.poll(self.time_limit + 0.5):
+                self.timeouts += 1
+                self.__restart()
+                raise ExpressionLimitError(f"Выражение не вычислилось "
+                                           f"за {self.time_limit:g} с")
+            try:
+                status, message = self.__conn.recv()
+            except EOFError:
+                # the worker was killed by its cpu limit
+                self.timeouts += 1
+                self.__restart()
+                raise ExpressionLimitError(f"Выражение не вычислилось "
+                                           f"за {self.time_limit:g} с")
+
+        match status:
+            case "memory":
+                raise ExpressionLimitError(f"Выражению не хватило "
+                                           f"{self.memory_limit / 1024 ** 3:g} ГБ памяти")
+            case "error":
+                raise ValueError(message)
+        return message
+
+    def __start(self):
+        self.__conn, child_conn = self.__context.Pipe()
+        self.__process = self.__context.Process(target=_worker, args=(child_conn, self.memory_limit), daemon=True)
+        self.__process.start()
+        child_conn.close()
+        self.__ready = False
+
+    def __stop(self):
+        if self.__process is not None:
+            self.__process.kill()
+            self.__process.join()
+            self.__conn.close()
+            self.__process = None
+
+    def __restart(self):
+        self.__stop()
+        self.__start()
+
+    def __wait_ready(self) -> bool:
+        # the worker imports sympy before it answers, that time is not part of the budget
+        if self.__ready:
+            return True
+        if not self.__conn.poll(self.startup_timeout):
+            return False
+        try:
+            self.__ready = self.__conn.recv() == "ready"
+        except EOFError:
+            return False
+        return self.__ready
+
+
+def _worker(conn, memory_limit: int):
+    if resource is not None:
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, resource.getrlimit(resource.RLIMIT_DATA)[1]))
+    import numpy as np
+    import backends  # loads sympy before the first budget starts
+    import mat
+    conn.send("ready")
+
+    while True:
+        try:
+            kind, args, time_limit = conn.recv()
+        except EOFError:
+            return
+        if resource is not None:
+            # the cpu limit counts from process start, so it is moved forward for every expression
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            soft = math.ceil(usage.ru_utime + usage.ru_stime + time_limit)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.getrlimit(resource.RLIMIT_CPU)[1]))
+
+        try:
+            if kind == "derivative":
+                conn.send(("ok", mat.differentiate(*args)))
+                continue
+            text, var, mods, backend, cache_dir = args
+            mat.expression_cache.cache_dir = cache_dir
+            func = mat.expression_cache.compile(text, var, mods, backend)
+            if len(inspect.signature(func).parameters) == 0:
+                func()
+            else:
+                grid = np.linspace(-10, 10, 64)
+                args = [grid] if len(var.split()) == 1 else [grid[None, :], grid[:, None]]
+                with np.errstate(all="ignore"):
+                    func(*args, *[1.0] * len(func.params))
+            conn.send(("ok", None))
+        except MemoryError:
+            conn.send(("memory", None))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+from typing import Callable
+
+import numpy as np
+from matplotlib.colors import to_hex
+
+import mat
+
+FORMAT_VERSION = 1
+
+
+def sidecar_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".npz"
+
+
+def save_session(path: str, graphs: list[tuple[str, mat.AbstractGraph]], xlim: tuple[float, float],
+                 ylim: tuple[float, float], with_samples=True):
+    # the manifest keeps everything that is typed in, the sidecar keeps the arrays
+    arrays: dict[str, np.ndarray] = {}
+    # derived graphs refer to their source by its position in the list
+    indices = {id(graph): i for i, (_, graph) in enumerate(graphs)}
+    entries = [dump_graph(f"g{i}", text, graph, arrays, with_samples, indices)
+               for i, (text, graph) in enumerate(graphs)]
+    manifest = {
+        "version": FORMAT_VERSION,
+        "xlim": [float(v) for v in xlim],
+        "ylim": [float(v) for v in ylim],
+        "data": os.path.basename(sidecar_path(path)) if arrays else None,
+        "graphs": entries,
+    }
+
+    # the sidecar is written first, so a manifest never refers to arrays that are not there yet
+    if arrays:
+        _replace(sidecar_path(path), lambda f: np.savez(f, **arrays))
+    _replace(path, lambda f: f.write(json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8")))
+
+
+def load_session(path: str) -> tuple[dict, dict[str, np.ndarray]]:
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError(f"unsupported session version {manifest.get('version')}")
+
+    arrays = {}
+    if manifest.get("data"):
+        with np.load(os.path.join(os.path.dirname(path), manifest["data"]), allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+    return manifest, arrays
+
+
+def dump_graph(key: str, text: str, graph: mat.AbstractGraph, arrays: dict[str, np.ndarray],
+               with_samples: bool, indices: dict[int, int] = None) -> dict:
+    label = graph.line.get_label()
+    entry = {
+        "type": graph.graph_type.value,
+        "text": text,
+        "color": to_hex(graph.line.get_color()),
+        "label": None if not label or label[0] == "_" else label,
+    }
+    if isinstance(graph, mat.LimGraph):
+        entry["lim_x"] = dump_range(graph.lim_x)
+        entry["lim_y"] = dump_range(graph.lim_y)
+
+    if isinstance(graph, mat.DerivedGraph):
+        entry["source"] = (indices or {}).get(id(graph.source))
+
+    if isinstance(graph, mat.FuncGraph):
+        entry["expression"] = graph.text
+        entry["backend"] = graph.backend
+        entry["params"] = {name: float(value) for name, value in graph.params.items()}
+        entry["family"] = graph.family
+        if with_samples and graph.func is not None:
+            if graph.family is not None:
+                # the paths keep the nan breaks, get_segments drops them
+                paths = graph.collection.get_paths()
+                names = [f"{key}_segments"]
+                arrays[names[0]] = np.stack([path.vertices for path in paths]) if paths else np.empty((0, 0, 2))
+            else:
+                names = [f"{key}_x", f"{key}_y"]
+                arrays[names[0]] = np.asarray(graph.line.get_xdata(), dtype=np.float64)
+                arrays[names[1]] = np.asarray(graph.line.get_ydata(), dtype=np.float64)
+            # samples are only valid for the limits they were taken for
+            entry["samples"] = {"arrays": names, "viewport": _limits(graph)}
+
+    elif isinstance(graph, mat.GraphPoints):
+        entry["capacity"] = graph.capacity
+        entry["points"] = f"{key}_points"
+        arrays[entry["points"]] = np.column_stack((graph.x_points, graph.y_points))
+    return entry
+
+
+def restore_graph(entry: dict, arrays: dict[str, np.ndarray],
+                  graphs: list[mat.AbstractGraph] = None) -> tuple[mat.AbstractGraph, tuple | None]:
+    # returns the graph and its stored samples, if there are any; graphs are the ones restored before it
+    graph = mat.create_graph(mat.GraphType(entry["type"]))
+    graph.line.set_color(entry["color"])
+    if entry.get("label"):
+        graph.line.set_label(entry["label"])
+    if isinstance(graph, mat.LimGraph):
+        graph.lim_x = load_range(entry["lim_x"])
+        graph.lim_y = load_range(entry["lim_y"])
+
+    samples = None
+    if isinstance(graph, mat.FuncGraph):
+        graph.backend = entry["backend"]
+        if isinstance(graph, mat.DerivedGraph):
+            source = entry.get("source")
+            graphs = graphs or []
+            if source is None or not 0 <= source < len(graphs) or not isinstance(graphs[source], mat.FuncGraph):
+                raise ValueError(f"no source for {entry['type']}")
+            graph.source = graphs[source]
+            graph.sync()
+        elif entry["expression"] is not None:
+            graph.process_text(entry["expression"])
+        for name, value in entry["params"].items():
+            if name in graph.params:
+                graph.set_param(name, value)
+        if entry["family"] in graph.params:
+            graph.set_family(entry["family"])
+        if "samples" in entry and graph.func is not None:
+            data = [arrays[name] for name in entry["samples"]["arrays"]]
+            samples = (entry["samples"]["viewport"], data[0] if len(data) == 1 else tuple(data))
+
+    elif isinstance(graph, mat.GraphPoints):
+        graph.set_capacity(entry["capacity"])
+        graph.set_points(arrays[entry["points"]])
+    return graph, samples
+
+
+def apply_samples(graph: mat.FuncGraph, samples: tuple) -> bool:
+    # shows the stored samples right away; true if they belong to the graph's current limits
+    viewport, data = samples
+    graph.set_data(data)
+    return viewport == _limits(graph)
+
+
+def dump_range(lim: mat.DynamicRange) -> dict:
+    return {
+        "min": None if lim.min is None else float(lim.min),
+        "min_is_dynamic": lim.min_is_dynamic,
+        "max": None if lim.max is None else float(lim.max),
+        "max_is_dynamic": lim.max_is_dynamic,
+    }
+
+
+def load_range(data: dict) -> mat.DynamicRange:
+    return mat.DynamicRange(data["min"], data["min_is_dynamic"], data["max"], data["max_is_dynamic"])
+
+
+def _limits(graph: mat.LimGraph) -> list[float | None]:
+    limits = (graph.lim_x.min, graph.lim_x.max, graph.lim_y.min, graph.lim_y.max)
+    return [None if v is None else float(v) for v in limits]
+
+
+def _replace(path: str, write: Callable):
+    # written next to the target and renamed over it, so an interrupted save leaves the old file intact
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with open(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
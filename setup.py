@@ -1,6 +1,6 @@
 from cx_Freeze import setup, Executable
 
-build_exe_option = {"include_files": [("files", "files")]}
+build_exe_option = {"include_files": [("files", "files")], "excludes": ["tkinter"]}
 
 setup(
    name="Elmos",
@@ -1,8 +1,72 @@
+import argparse
+import multiprocessing
 import sys
-from PyQt5.QtWidgets import QApplication
-from ui import MainWindow
+import time
 
-app = QApplication(sys.argv)
-w = MainWindow()
-w.show()
-app.exec()
+
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+
+    def phase(self, name: str):
+        self.phases.append((name, time.perf_counter()))
+
+    @property
+    def total(self) -> float:
+        return self.phases[-1][1] - self.start if self.phases else 0.0
+
+    def report(self) -> str:
+        lines = ["startup: self [ms] | cumulative [ms] | phase"]
+        previous = self.start
+        for name, moment in self.phases:
+            lines.append(f"startup: {(moment - previous) * 1000:9.1f} | {(moment - self.start) * 1000:16.1f} | {name}")
+            previous = moment
+        return "\n".join(lines)
+
+
+def main(argv: list[str]) -> int:
+    timer = StartupTimer()
+    parser = argparse.ArgumentParser(description="Elmos")
+    parser.add_argument("--startup-report", action="store_true", help="print the time spent in each startup phase")
+    parser.add_argument("--startup-budget", type=float, metavar="SECONDS",
+                        help="exit after the first window is shown, with an error if it took longer than this")
+    parser.add_argument("--session", metavar="PATH", help="open a saved session")
+    args, qt_args = parser.parse_known_args(argv[1:])
+
+    from PyQt5.QtWidgets import QApplication
+    timer.phase("import PyQt5")
+    import mat
+    timer.phase("import mat")
+    from ui import MainWindow
+    timer.phase("import ui")
+
+    app = QApplication([argv[0], *qt_args])
+    timer.phase("QApplication")
+    w = MainWindow()
+    timer.phase("MainWindow")
+    w.show()
+    app.processEvents()
+    timer.phase("first window")
+    if args.session:
+        w.open_session(args.session)
+        timer.phase("open session")
+
+    # the window is already on screen, sympy is loaded while the user types the first function
+    mat.preload_sympy()
+
+    if args.startup_report or args.startup_budget is not None:
+        print(timer.report(), file=sys.stderr)
+    if args.startup_budget is not None:
+        if timer.total > args.startup_budget:
+            print(f"startup: first window after {timer.total:.3f} s, budget is {args.startup_budget:.3f} s",
+                  file=sys.stderr)
+            return 1
+        return 0
+    return app.exec()
+
+
+if __name__ == "__main__":
+    # the expression sandbox and worker pools start new processes from the frozen executable
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv))
@@ -0,0 +1,135 @@
+import os
+import socket
+import stat
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class PointStream:
+    chunk_size = 1 << 16
+
+    def __init__(self, path: str, binary: bool | None = None, max_pending=1_000_000):
+        # a regular file is followed like tail -f, a fifo is read as its writers come and go,
+        # a unix socket is connected to and read until the other side closes it
+        self.path = path
+        self.is_socket = stat.S_ISSOCK(os.stat(path).st_mode)
+        self.binary = os.path.splitext(path)[1].lower() in (".bin", ".raw", ".f64") if binary is None else binary
+        self.max_pending = max_pending
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+        self.bytes = 0
+        self.max_queued = 0
+        self.closed = False
+        self.error: Exception | None = None
+        self.__chunks: deque[np.ndarray] = deque()
+        self.__pending = 0
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__socket = None
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self.__pending
+
+    def poll(self) -> np.ndarray | None:
+        with self.__lock:
+            if not self.__chunks:
+                return None
+            chunks = list(self.__chunks)
+            self.__chunks.clear()
+            self.__pending = 0
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    def stop(self):
+        self.__stop.set()
+        if self.__socket is not None:
+            try:
+                self.__socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __run(self):
+        try:
+            if self.is_socket:
+                self.__read_socket()
+            else:
+                self.__read_file()
+        except Exception as e:
+            self.error = e
+        self.closed = True
+
+    def __read_file(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            rest = b""
+            while not self.__stop.is_set():
+                data = os.read(fd, self.chunk_size)
+                if not data:
+                    # end of a growing file, or of a fifo without writers
+                    self.__stop.wait(0.02)
+                    continue
+                rest = self.__feed(rest + data)
+        finally:
+            os.close(fd)
+
+    def __read_socket(self):
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.__socket.connect(self.path)
+            rest = b""
+            while not self.__stop.is_set():
+                data = self.__socket.recv(self.chunk_size)
+                if not data:
+                    break
+                rest = self.__feed(rest + data)
+        finally:
+            self.__socket.close()
+
+    def __feed(self, data: bytes) -> bytes:
+        self.bytes += len(data)
+        if self.binary:
+            end = len(data) - len(data) % 16
+            points = np.frombuffer(data, dtype="<f8", count=end // 8).reshape(-1, 2)
+        else:
+            end = data.rfind(b"\n") + 1
+            points = self.__parse(data[:end])
+        self.__push(points)
+        return data[end:]
+
+    def __parse(self, data: bytes) -> np.ndarray:
+        text = data.replace(b",", b" ").replace(b";", b" ").replace(b"\t", b" ")
+        try:
+            values = np.array(text.split(), dtype=np.float64)
+            if len(values) == 2 * data.count(b"\n"):
+                return values.reshape(-1, 2)
+        except ValueError:
+            pass
+        # headers, empty or malformed lines are skipped one by one
+        points = []
+        for line in text.splitlines():
+            try:
+                x, y = line.split()[:2]
+                points.append((float(x), float(y)))
+            except ValueError:
+                if line.strip():
+                    self.errors += 1
+        return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+    def __push(self, points: np.ndarray):
+        if len(points) == 0:
+            return
+        with self.__lock:
+            self.__chunks.append(points)
+            self.__pending += len(points)
+            self.received += len(points)
+            self.max_queued = max(self.max_queued, self.__pending)
+            # the reader never waits for the gui, points the gui did not take in time are dropped oldest first
+            while self.__pending > self.max_pending and len(self.__chunks) > 1:
+                dropped = self.__chunks.popleft()
+                self.__pending -= len(dropped)
+                self.dropped += len(dropped)
@@ -1,15 +1,24 @@
 import os
 import re
+import time
+from weakref import WeakKeyDictionary
 
-from PyQt5.QtCore import QUrl
+from PyQt5.QtCore import QUrl, QObject, pyqtSignal, QTimer, Qt
 from PyQt5.QtGui import QIcon
 from matplotlib.axes import Axes
+from matplotlib.lines import Line2D
 
+import analysis
+import evaluator
 import mat
+import session
+from profiling import profiler
+from sandbox import ExpressionLimitError, Sandbox
+from stream import PointStream
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QLineEdit, QHBoxLayout, QColorDialog, \
-    QMainWindow, QScrollArea, QCheckBox, QButtonGroup, QMessageBox, QComboBox, QTextBrowser, QAction
-from matplotlib.backends.backend_qt import NavigationToolbar2QT
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
+    QMainWindow, QScrollArea, QCheckBox, QButtonGroup, QMessageBox, QComboBox, QTextBrowser, QAction, QFileDialog, \
+    QSlider, QInputDialog
+from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg, NavigationToolbar2QT
 from matplotlib.figure import Figure
 
 
@@ -139,6 +148,17 @@ class CustomizeLineWindow(QWidget):
             layout.addWidget(self.lim_x_widget)
             layout.addWidget(self.lim_y_widget)
 
+        if isinstance(self.graph, mat.FuncGraph):
+            self.backend_label = QLabel("Вычисление:")
+            self.backend_box = QComboBox()
+            from backends import BACKENDS
+            self.backend_box.addItems(BACKENDS)
+            self.backend_box.setCurrentText(self.graph.backend)
+            backend_lay = QHBoxLayout()
+            backend_lay.addWidget(self.backend_label)
+            backend_lay.addWidget(self.backend_box)
+            layout.addLayout(backend_lay)
+
         layout.addWidget(self.apply_button)
         self.setLayout(layout)
 
@@ -151,39 +171,234 @@ class CustomizeLineWindow(QWidget):
 
     def apply_settings(self):
         self.graph.line.set_color(self.color)
+        if isinstance(self.graph, mat.FuncGraph) and self.graph.collection is not None:
+            self.graph.collection.set_color(self.color)
         self.graph.line.set_label(self.title_field.text().replace("_", ""))
         if isinstance(self.graph, mat.LimGraph):
             self.lim_x_widget.apply_settings()
             self.lim_y_widget.apply_settings()
+        if isinstance(self.graph, mat.FuncGraph) and self.backend_box.currentText() != self.graph.backend:
+            self.graph.backend = self.backend_box.currentText()
+            if self.graph.text is not None:
+                try:
+                    self.graph.process_text(self.graph.text)
+                except ExpressionLimitError as e:
+                    QMessageBox.warning(self, "Error", str(e))
         self.ax.legend()
         self.canvas.draw()
 
 
+class SampleBridge(QObject):
+    sampled = pyqtSignal(object, object)
+
+
+class QualityGovernor:
+    def __init__(self, target_frame_time=1 / 30, min_quality=0.125):
+        self.target_frame_time = target_frame_time
+        self.min_quality = min_quality
+        self.quality = 1.0
+        self.frame_time = 0.0
+        self.__floor = min_quality
+        self.__lowered: tuple[float, float] | None = None
+
+    @property
+    def graph_budget(self) -> float:
+        # a graph that alone takes longer than this is left as it is until the input stops
+        return 2 * self.target_frame_time
+
+    def record(self, frame_time: float, interactive: bool):
+        self.frame_time = frame_time if self.frame_time == 0 else 0.7 * self.frame_time + 0.3 * frame_time
+        if not interactive:
+            return
+        # part of a frame does not depend on the samples, below the quality where frames stop
+        # getting faster nothing is gained
+        if self.__lowered is not None and frame_time > 0.9 * self.__lowered[1]:
+            self.__floor = max(self.__floor, self.__lowered[0])
+        ratio = self.target_frame_time / max(self.frame_time, 1e-6)
+        quality = min(max(self.quality * min(max(ratio, 0.5), 1.25), self.__floor), 1.0)
+        self.__lowered = (self.quality, frame_time) if quality < self.quality else None
+        self.quality = quality
+
+    def refine(self) -> bool:
+        if self.quality >= 1.0:
+            self.__floor = self.min_quality
+            self.__lowered = None
+            return False
+        self.quality = min(self.quality * 2, 1.0)
+        return True
+
+
 class RedrawCanvas(FigureCanvasQTAgg):
 
     def __init__(self, figure=None, main_w=None):
         super().__init__(figure)
         self.main_v = main_w
+        self.__render_pending = False
+        self.coalesced_count = 0
+
+        self.__redraw_timer = QTimer(self)
+        self.__redraw_timer.setSingleShot(True)
+        self.__redraw_timer.setInterval(16)
+        self.__redraw_timer.timeout.connect(self.draw)
+
+        self.__background = None
+        self.__background_size = None
+        self.__interaction_timer = QTimer(self)
+        self.__interaction_timer.setSingleShot(True)
+        self.__interaction_timer.setInterval(250)
+        self.__interaction_timer.timeout.connect(self.end_interaction)
+
+        self.overlay = None
+        self.governor = QualityGovernor()
 
     def draw(self, *args, **kwargs):
-        self.main_v.redraw()
+        start = time.perf_counter()
+        with profiler.frame():
+            self.main_v.redraw()
+            self.__render()
+        self.__record_frame(start)
+
+    def show_overlay(self, visible: bool):
+        if visible and self.overlay is None:
+            self.overlay = self.figure.text(0.01, 0.99, "", va="top", family="monospace", fontsize=8,
+                                            animated=True, bbox={"facecolor": "white", "alpha": 0.7})
+        elif not visible and self.overlay is not None:
+            self.overlay.remove()
+            self.overlay = None
+
+    @property
+    def interactive(self):
+        return self.__background is not None
+
+    def begin_interaction(self):
+        # while panning or zooming only the lines are redrawn over a cached background
+        self.__interaction_timer.start()
+        if self.__background is None:
+            self.__set_animated(True)
+            self.__cache_background()
+
+    def end_interaction(self):
+        self.__interaction_timer.stop()
+        if self.__background is not None:
+            self.__background = None
+            self.__set_animated(False)
+            if self.governor.quality < 1.0:
+                self.refine()
+            else:
+                self.draw()
+
+    def refine(self):
+        # after the input stops the quality goes up step by step, each step once its samples are drawn
+        if self.interactive:
+            return
+        if self.main_v.evaluator.pending:
+            QTimer.singleShot(16, self.refine)
+        elif self.governor.refine():
+            self.draw()
+            QTimer.singleShot(0, self.refine)
+
+    def draw_idle(self):
+        # scroll and pan requests arriving within one frame share a single redraw
+        if self.__redraw_timer.isActive():
+            self.coalesced_count += 1
+        else:
+            self.__redraw_timer.start()
+
+    def render_later(self):
+        # renders the figure once for any number of background results, without sampling graphs again
+        if not self.__render_pending:
+            self.__render_pending = True
+            QTimer.singleShot(0, self.__render_frame)
+
+    def __render_frame(self):
+        start = time.perf_counter()
+        self.__render()
+        self.__record_frame(start)
+
+    def __record_frame(self, start: float):
+        self.governor.record(time.perf_counter() - start, self.interactive)
+        profiler.counter("quality", self.governor.quality)
+        profiler.counter("frame_time", self.governor.frame_time)
+
+    def __render(self):
+        self.__render_pending = False
+        self.main_v.update_analysis()
+        with profiler.stage("rasterize"):
+            if self.__background is None:
+                super().draw()
+            else:
+                if self.get_width_height() != self.__background_size:
+                    self.__cache_background()
+                self.restore_region(self.__background)
+                for ax in self.figure.axes:
+                    for artist in [*ax.get_lines(), *ax.collections]:
+                        ax.draw_artist(artist)
+
+        if self.overlay is not None:
+            slowest = profiler.slowest_graph()
+            text = f"frame {self.governor.frame_time * 1000:.1f} ms, quality {self.governor.quality:.2f}"
+            if slowest is not None:
+                text += f"\nslowest {slowest[0]}: {slowest[1] * 1000:.1f} ms"
+            self.overlay.set_text(text)
+            self.figure.draw_artist(self.overlay)
+        if self.__background is not None:
+            self.blit(self.figure.bbox)
+
+    def __cache_background(self):
         super().draw()
+        self.__background = self.copy_from_bbox(self.figure.bbox)
+        self.__background_size = self.get_width_height()
+
+    def __set_animated(self, animated: bool):
+        for ax in self.figure.axes:
+            for artist in [*ax.get_lines(), *ax.collections]:
+                artist.set_animated(animated)
+
+
+class ParamSlider(QWidget):
+    steps = 200
+
+    def __init__(self, name: str, value: float, value_range: tuple[float, float], with_family: bool):
+        super().__init__()
+        self.value_range = value_range
+
+        lay = QHBoxLayout()
+        lay.setSpacing(5)
+        lay.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(lay)
+
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setRange(0, self.steps)
+        self.slider.setValue(round((value - value_range[0]) / (value_range[1] - value_range[0]) * self.steps))
+        self.value_label = QLabel(f"{value:g}")
+        self.value_label.setMinimumWidth(40)
+        self.slider.valueChanged.connect(lambda step: self.value_label.setText(f"{self.value:g}"))
+        lay.addWidget(QLabel(f"{name} = "))
+        lay.addWidget(self.slider)
+        lay.addWidget(self.value_label)
+
+        self.family_checkbox = QCheckBox("Семейство")
+        self.family_checkbox.setVisible(with_family)
+        lay.addWidget(self.family_checkbox)
+
+    @property
+    def value(self) -> float:
+        low, high = self.value_range
+        return round(low + (high - low) * self.slider.value() / self.steps, 6)
 
 
 class InputFuncWindget(QWidget):
+    stream_capacity = 200_000
+    stream_hz = 30
+
     def __init__(self, parent, graph_type: mat.GraphType, ax: Axes, canvas):
         super().__init__(parent)
         parent.layout().addWidget(self)
         self.graph_type = graph_type
         self.ax = ax
         self.canvas = canvas
-        match graph_type:
-            case mat.GraphType.X:
-                self.graph = mat.GraphX()
-            case mat.GraphType.Y:
-                self.graph = mat.GraphY()
-            case mat.GraphType.POINTS:
-                self.graph = mat.GraphPoints([])
+        self.graph = mat.create_graph(graph_type)
+        self.param_sliders: dict[str, ParamSlider] = {}
 
         self.setMaximumHeight(130)
         main_lay = QVBoxLayout()
@@ -194,9 +409,20 @@ class InputFuncWindget(QWidget):
         lay1 = QHBoxLayout()
         lay1.setSpacing(0)
         lay1.setContentsMargins(0, 0, 0, 0)
-        label = QLabel(self.graph_type.value + " = ")
+        if graph_type == mat.GraphType.IMPLICIT:
+            label = QLabel("F(x, y) = 0: ")
+        elif graph_type == mat.GraphType.DERIVATIVE:
+            label = QLabel("Производная: ")
+        elif graph_type == mat.GraphType.INTEGRAL:
+            label = QLabel("Интеграл: ")
+        else:
+            label = QLabel(self.graph_type.value + " = ")
         self.text = QLineEdit()
         self.text.setPlaceholderText("Введите уравнение")
+        if isinstance(self.graph, mat.DerivedGraph):
+            # derived graphs are computed from their source, there is nothing to type in
+            self.text.setReadOnly(True)
+            self.text.setPlaceholderText("")
         lay1.addWidget(label)
         lay1.addWidget(self.text)
 
@@ -216,22 +442,171 @@ class InputFuncWindget(QWidget):
         lay2.addWidget(delete_btn)
         lay2.addWidget(customize_btn)
 
+        if graph_type in (mat.GraphType.X, mat.GraphType.Y):
+            derivative_btn = QPushButton("f′")
+            derivative_btn.setToolTip("Добавить производную")
+            derivative_btn.clicked.connect(lambda: self.canvas.main_v.add_derived_field(self, mat.GraphType.DERIVATIVE))
+            lay2.addWidget(derivative_btn)
+
+            integral_btn = QPushButton("∫f")
+            integral_btn.setToolTip("Добавить интеграл от 0")
+            integral_btn.clicked.connect(lambda: self.canvas.main_v.add_derived_field(self, mat.GraphType.INTEGRAL))
+            lay2.addWidget(integral_btn)
+
+        self.stream: PointStream | None = None
+        self.stream_label = None
+        if graph_type == mat.GraphType.POINTS:
+            load_btn = QPushButton("Файл")
+            load_btn.clicked.connect(self.load_file)
+            lay2.addWidget(load_btn)
+
+            self.stream_btn = QPushButton("Поток")
+            self.stream_btn.clicked.connect(self.toggle_stream)
+            lay2.addWidget(self.stream_btn)
+            self.stream_label = QLabel()
+            self.stream_label.setVisible(False)
+            # new points are taken from the stream at most stream_hz times a second, however fast they come
+            self.stream_timer = QTimer(self)
+            self.stream_timer.setInterval(1000 // self.stream_hz)
+            self.stream_timer.timeout.connect(self.poll_stream)
+
+        self.params_lay = QVBoxLayout()
+        self.params_lay.setSpacing(0)
+        self.params_lay.setContentsMargins(0, 5, 0, 0)
+
         main_lay.addLayout(lay1)
         main_lay.addLayout(lay2)
+        main_lay.addLayout(self.params_lay)
+        if self.stream_label is not None:
+            main_lay.addWidget(self.stream_label)
 
     def draw(self):
         try:
             mat.plot(self.text.text(), self.graph, self.ax)
+            # plot() has sampled the graph already, the redraw below does not have to again
+            self.canvas.main_v.drawn_states[self.graph] = self.graph.state()
+            if isinstance(self.graph, mat.DerivedGraph):
+                self.text.setText(self.graph.label)
+            self.update_params()
             self.canvas.draw()
+        except ExpressionLimitError as e:
+            QMessageBox.warning(self, "Error", str(e))
         except Exception as e:
             QMessageBox.warning(self, "Error", "Wrong function")
 
-    def delete_graph(self):
+    def update_params(self):
+        # derived graphs take their parameters from the source's sliders
+        names = list(self.graph.params) if isinstance(self.graph, mat.FuncGraph) else []
+        if isinstance(self.graph, mat.DerivedGraph):
+            names = []
+        if names == list(self.param_sliders):
+            return
+        for slider in self.param_sliders.values():
+            self.params_lay.removeWidget(slider)
+            slider.deleteLater()
+        self.param_sliders = {}
+
+        with_family = self.graph_type in (mat.GraphType.X, mat.GraphType.Y)
+        for name in names:
+            slider = ParamSlider(name, self.graph.params[name], self.graph.param_range, with_family)
+            slider.family_checkbox.setChecked(self.graph.family == name)
+            slider.slider.valueChanged.connect(lambda step, name=name: self.change_param(name))
+            slider.family_checkbox.toggled.connect(lambda checked, name=name: self.toggle_family(name, checked))
+            self.params_lay.addWidget(slider)
+            self.param_sliders[name] = slider
+        self.setMaximumHeight(130 + 30 * len(names))
+
+    def change_param(self, name: str):
+        # the expression is compiled once, moving a slider only samples it again
+        self.graph.set_param(name, self.param_sliders[name].value)
+        self.canvas.draw_idle()
+
+    def toggle_family(self, name: str, checked: bool):
+        if checked:
+            for other, slider in self.param_sliders.items():
+                if other != name:
+                    slider.family_checkbox.setChecked(False)
+            self.graph.set_family(name)
+            mat.add_artists(self.graph, self.ax)
+        elif self.graph.family == name:
+            self.graph.set_family(None)
+        self.canvas.draw_idle()
+
+    def load_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Загрузить точки", "",
+                                              "Данные (*.csv *.txt *.npy *.bin);;Все файлы (*)")
+        if not path:
+            return
+        try:
+            self.graph.load(path)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", "Wrong file")
+            return
+
+        if self.graph.line not in self.ax.get_lines():
+            self.ax.add_line(self.graph.line)
+        self.canvas.draw()
+
+    def toggle_stream(self):
+        if self.stream is not None:
+            self.stop_stream()
+            return
+        path, ok = QInputDialog.getText(self, "Поток точек", "Файл, канал или сокет:")
+        if not ok or not path:
+            return
+        try:
+            self.stream = PointStream(path, max_pending=self.stream_capacity)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", "Wrong stream")
+            return
+
+        self.graph.set_capacity(self.stream_capacity)
+        mat.add_artists(self.graph, self.ax)
+        self.stream_btn.setText("Стоп")
+        self.stream_label.setVisible(True)
+        self.setMaximumHeight(150)
+        self.stream_timer.start()
+
+    def stop_stream(self):
+        self.stream_timer.stop()
+        self.stream.stop()
+        self.stream = None
+        self.stream_btn.setText("Поток")
+
+    def poll_stream(self):
+        points = self.stream.poll()
+        if points is not None:
+            self.graph.extend(points[:, 0], points[:, 1])
+            self.canvas.draw_idle()
+        stream = self.stream
+        text = (f"Получено: {stream.received}, пропущено: {stream.dropped}, "
+                f"ошибок: {stream.errors}")
+        if stream.error is not None:
+            text += f", {stream.error}"
+        self.stream_label.setText(text)
+        if stream.closed and stream.pending == 0:
+            self.stop_stream()
+
+    def set_graph(self, graph: mat.AbstractGraph, text: str):
+        self.graph = graph
+        self.text.setText(text)
+        mat.add_artists(graph, self.ax)
+        self.update_params()
+
+    def remove(self):
+        for ifw in list(self.canvas.main_v.input_func_widgets):
+            if isinstance(ifw.graph, mat.DerivedGraph) and ifw.graph.source is self.graph:
+                ifw.remove()
+        if self.stream is not None:
+            self.stop_stream()
         self.parent().layout().removeWidget(self)
         self.deleteLater()
-
+        self.canvas.main_v.input_func_widgets.remove(self)
         mat.delete_graph(self.graph, self.ax)
 
+    def delete_graph(self):
+        self.remove()
+
         if len(self.ax.get_legend_handles_labels()[0]) == 0:
             self.ax.legend_ = None
         else:
@@ -266,6 +641,19 @@ class MainWindow(QMainWindow):
         super().__init__()
 
         self.input_func_widgets: list[InputFuncWindget] = []
+        mat.expression_cache.cache_dir = os.path.join(os.path.expanduser("~"), ".elmos", "expressions")
+        if mat.expression_cache.sandbox is None:
+            mat.expression_cache.sandbox = Sandbox()
+        self.evaluator = evaluator.Evaluator()
+        self.sample_bridge = SampleBridge()
+        self.sample_bridge.sampled.connect(self.apply_samples)
+        self.drawn_states: WeakKeyDictionary[mat.AbstractGraph, tuple] = WeakKeyDictionary()
+        self.redraw_count = 0
+        self.graph_draw_count = 0
+        self.graph_skip_count = 0
+        self.graph_costly_skip_count = 0
+        self.analyzer = analysis.Analyzer()
+        self.analysis_markers: list[Line2D] = []
 
         self.setWindowTitle("Elmos")
         self.setGeometry(100, 100, 1200, 800)
@@ -276,6 +664,7 @@ class MainWindow(QMainWindow):
         self.figure = Figure()
         self.canvas = RedrawCanvas(self.figure, self)
         self.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.canvas.mpl_connect("motion_notify_event", self.on_motion)
 
         self.ax = self.figure.add_subplot()
         self.ax.set_xlim(-10, 10)
@@ -303,8 +692,38 @@ class MainWindow(QMainWindow):
         self.open_docs_a.triggered.connect(self.open_docs)
         self.navbar.addAction(self.open_docs_a)
 
+        self.profile_a = QAction("Профилирование")
+        self.profile_a.setCheckable(True)
+        self.profile_a.setToolTip("Показывать время кадра "
+                                  "и самый медленный график")
+        self.profile_a.toggled.connect(self.toggle_profiling)
+        self.navbar.addAction(self.profile_a)
+
+        self.analysis_a = QAction("Анализ")
+        self.analysis_a.setCheckable(True)
+        self.analysis_a.setToolTip("Отмечать корни, экстремумы "
+                                   "и пересечения графиков")
+        self.analysis_a.toggled.connect(self.toggle_analysis)
+        self.navbar.addAction(self.analysis_a)
+
+        self.save_session_a = QAction("Сохранить сессию")
+        self.save_session_a.setToolTip("Сохранить все графики, "
+                                       "их настройки и данные")
+        self.save_session_a.triggered.connect(self.save_session)
+        self.navbar.addAction(self.save_session_a)
+
+        self.open_session_a = QAction("Открыть сессию")
+        self.open_session_a.setToolTip("Открыть сохраненные графики")
+        self.open_session_a.triggered.connect(lambda: self.open_session())
+        self.navbar.addAction(self.open_session_a)
+
+        self.export_trace_a = QAction("Экспорт трассировки")
+        self.export_trace_a.setToolTip("Сохранить замеры в формате Chrome trace")
+        self.export_trace_a.triggered.connect(self.export_trace)
+        self.navbar.addAction(self.export_trace_a)
+
         self.gtypes = QComboBox()
-        self.gtypes.addItems(["y", "x", "points"])
+        self.gtypes.addItems(["y", "x", "points", "implicit"])
         self.add_input_field_btn = QPushButton("+")
         self.add_input_field_btn.clicked.connect(lambda: self.add_input_field(self.gtypes.currentText()))
         gt_if_lay = QHBoxLayout()
@@ -327,20 +746,16 @@ class MainWindow(QMainWindow):
         self.lay.addLayout(gt_if_lay)
         self.lay.addWidget(self.scroll_area)
 
-    def add_input_field(self, graph_type: str):
-        match graph_type.lower():
-            case "x":
-                self.input_func_widgets.append(
-                    InputFuncWindget(self.scroll_content, mat.GraphType.X, self.ax, self.canvas)
-                )
-            case "y":
-                self.input_func_widgets.append(
-                    InputFuncWindget(self.scroll_content, mat.GraphType.Y, self.ax, self.canvas)
-                )
-            case "points":
-                self.input_func_widgets.append(
-                    InputFuncWindget(self.scroll_content, mat.GraphType.POINTS, self.ax, self.canvas)
-                )
+    def add_input_field(self, graph_type: str) -> InputFuncWindget:
+        widget = InputFuncWindget(self.scroll_content, mat.GraphType(graph_type.lower()), self.ax, self.canvas)
+        self.input_func_widgets.append(widget)
+        return widget
+
+    def add_derived_field(self, source: InputFuncWindget, graph_type: mat.GraphType) -> InputFuncWindget:
+        widget = self.add_input_field(graph_type.value)
+        widget.graph.source = source.graph
+        widget.draw()
+        return widget
 
     def home(self):
         self.ax.set_xlim(-10, 10)
@@ -348,13 +763,58 @@ class MainWindow(QMainWindow):
         self.canvas.draw()
 
     def redraw(self, *args):
+        self.redraw_count += 1
+        governor = self.canvas.governor
+        func_graphs = []
         for ifw in self.input_func_widgets:
+            if isinstance(ifw.graph, mat.DerivedGraph):
+                self.sync_derived(ifw)
             if isinstance(ifw.graph, mat.LimGraph):
-                x_min, x_max = self.ax.get_xlim()
-                y_min, y_max = self.ax.get_ylim()
-                ifw.graph.update_lim_x(x_min, x_max)
-                ifw.graph.update_lim_y(y_min, y_max)
-            ifw.graph.draw()
+                mat.update_view(ifw.graph, self.ax, governor.quality)
+
+            state = ifw.graph.state()
+            if self.drawn_states.get(ifw.graph) == state:
+                self.graph_skip_count += 1
+                continue
+            # the state is not stored, so a skipped graph is sampled again once the input stops
+            if (self.canvas.interactive and isinstance(ifw.graph, mat.FuncGraph)
+                    and ifw.graph.sample_time > governor.graph_budget):
+                self.graph_costly_skip_count += 1
+                continue
+            self.drawn_states[ifw.graph] = state
+            self.graph_draw_count += 1
+
+            if isinstance(ifw.graph, mat.FuncGraph) and ifw.graph.func is not None:
+                func_graphs.append(ifw.graph)
+            else:
+                ifw.graph.draw()
+        if func_graphs:
+            self.evaluator.submit_batch(func_graphs, self.sample_bridge.sampled.emit)
+
+    def sync_derived(self, ifw: InputFuncWindget):
+        # a changed source expression is picked up on the next frame, the derivative is taken only then
+        if ifw.graph.source is None:
+            return
+        try:
+            ifw.graph.sync()
+        except ExpressionLimitError as e:
+            self.drop_derived(ifw, str(e))
+        except Exception:
+            self.drop_derived(ifw, "Wrong function")
+        mat.add_artists(ifw.graph, self.ax)
+        # a failed derivative keeps its error in the row until the source changes
+        if ifw.graph.func is not None and ifw.text.text() != ifw.graph.label:
+            ifw.text.setText(ifw.graph.label)
+
+    def drop_derived(self, ifw: InputFuncWindget, message: str):
+        ifw.graph.func = None
+        ifw.graph.set_data(([], []))
+        ifw.text.setText(message)
+
+    def apply_samples(self, graph: mat.FuncGraph, data):
+        with profiler.stage("set_data", graph.label):
+            graph.set_data(data)
+        self.canvas.render_later()
 
     def on_scroll(self, event):
         cur_xlim = self.ax.get_xlim()
@@ -376,8 +836,113 @@ class MainWindow(QMainWindow):
         self.ax.set_ylim([center_y - cur_yrange * scale_factor,
                           center_y + cur_yrange * scale_factor])
 
-        self.canvas.draw()
+        self.canvas.begin_interaction()
+        self.canvas.draw_idle()
+
+    def on_motion(self, event):
+        if event.button is not None and self.navbar.mode == "pan/zoom":
+            self.canvas.begin_interaction()
 
     def open_docs(self):
         self.docs = DocWindow()
         self.docs.show()
+
+    def toggle_profiling(self, checked: bool):
+        profiler.enabled = checked
+        if checked:
+            profiler.reset()
+        self.canvas.show_overlay(checked)
+        self.canvas.draw()
+
+    def toggle_analysis(self, checked: bool):
+        if checked:
+            # roots, extrema and intersections
+            self.analysis_markers = [
+                Line2D([], [], linestyle="", marker="o", markersize=5, color="#000000", zorder=3),
+                Line2D([], [], linestyle="", marker="D", markersize=5, color="#ff8c00", zorder=3),
+                Line2D([], [], linestyle="", marker="X", markersize=7, color="#ff0000", zorder=3),
+            ]
+            for marker in self.analysis_markers:
+                self.ax.add_line(marker)
+        else:
+            for marker in self.analysis_markers:
+                marker.remove()
+            self.analysis_markers = []
+        self.canvas.draw()
+
+    def update_analysis(self):
+        # markers follow the final samples only, while panning or refining they keep their last positions
+        if (not self.analysis_markers or self.canvas.interactive or self.canvas.governor.quality < 1.0
+                or self.evaluator.pending):
+            return
+        found = self.analyzer.analyze([ifw.graph for ifw in self.input_func_widgets])
+        for marker, points in zip(self.analysis_markers, found):
+            marker.set_data(points[:, 0], points[:, 1])
+
+    def save_session(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить сессию", "session.elmos",
+                                              "Сессия Elmos (*.elmos)")
+        if not path:
+            return
+        try:
+            session.save_session(path, [(ifw.text.text(), ifw.graph) for ifw in self.input_func_widgets],
+                                 self.ax.get_xlim(), self.ax.get_ylim())
+        except OSError as e:
+            QMessageBox.warning(self, "Error", str(e))
+
+    def open_session(self, path: str | None = None):
+        if path is None:
+            path, _ = QFileDialog.getOpenFileName(self, "Открыть сессию", "",
+                                                  "Сессия Elmos (*.elmos)")
+            if not path:
+                return
+        try:
+            manifest, arrays = session.load_session(path)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", "Wrong session file")
+            return
+
+        while self.input_func_widgets:
+            self.input_func_widgets[-1].remove()
+        self.ax.set_xlim(*manifest["xlim"])
+        self.ax.set_ylim(*manifest["ylim"])
+
+        failed = []
+        graphs = []
+        for entry in manifest["graphs"]:
+            widget = self.add_input_field(entry["type"])
+            try:
+                graph, samples = session.restore_graph(entry, arrays, graphs)
+            except Exception as e:
+                failed.append(entry["text"])
+                widget.text.setText(entry["text"])
+                graphs.append(widget.graph)
+                continue
+            graphs.append(graph)
+            widget.set_graph(graph, entry["text"])
+            if isinstance(graph, mat.LimGraph):
+                mat.update_view(graph, self.ax, self.canvas.governor.quality)
+            # stored samples are drawn as they are, the graph is sampled again once the view changes
+            if samples is not None and session.apply_samples(graph, samples):
+                self.drawn_states[graph] = graph.state()
+
+        if self.ax.get_legend_handles_labels()[0]:
+            self.ax.legend()
+        else:
+            self.ax.legend_ = None
+        self.canvas.draw()
+        if failed:
+            QMessageBox.warning(self, "Error", "Не удалось восстановить: " + ", ".join(failed))
+
+    def export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Экспорт трассировки", "trace.json",
+                                              "JSON (*.json)")
+        if path:
+            profiler.export_chrome_trace(path)
+
+    def closeEvent(self, event):
+        self.evaluator.shutdown()
+        if mat.expression_cache.sandbox is not None:
+            mat.expression_cache.sandbox.shutdown()
+            mat.expression_cache.sandbox = None
+        super().closeEvent(event)